@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+
+'''
+NOTES:
+Array helpers for RunDMD bitmaps.  A bitmap is 128x32 pixels with one 4-bit intensity per pixel.  In the binary image the
+pixels are packed two per byte (high nibble first), and in the JSON files each row is a '|...|' delimited hex string.  Here
+a bitmap is a (32, 128) numpy uint8 array holding one nibble per element, and a list of frames is a (N, 32, 128) array.
+
+Nibble value 0xa is transparency, which leaves 15 real intensity levels: 0-9 and 0xb-0xf.
+'''
+
+import numpy as np
+
+bitmap_width =          128
+bitmap_height =         32
+bitmap_size =           bitmap_width * bitmap_height // 2 # One pixel per nibble
+transparent =           0xa
+
+# Same colors as the animation editor (animation_editor/js/editor.js), with transparency as alpha 0
+palette_rgb = [
+    (0x00, 0x00, 0x00), (0x70, 0x00, 0x00), (0x7b, 0x00, 0x00), (0x86, 0x00, 0x00),
+    (0x91, 0x00, 0x00), (0x9c, 0x00, 0x00), (0xa7, 0x00, 0x00), (0xb2, 0x00, 0x00),
+    (0xbd, 0x00, 0x00), (0xc8, 0x00, 0x00), (0xe0, 0xe0, 0xe0), (0xd3, 0x00, 0x00),
+    (0xde, 0x00, 0x00), (0xe9, 0x00, 0x00), (0xf4, 0x00, 0x00), (0xff, 0x00, 0x00)
+]
+palette_rgba = np.array([rgb + (0 if i == transparent else 255,) for i, rgb in enumerate(palette_rgb)], dtype=np.uint8)
+
+# ASCII hex digit -> nibble and nibble -> ASCII hex digit lookup tables
+_hex_to_nibble = np.zeros(256, dtype=np.uint8)
+for _i, _c in enumerate(b'0123456789abcdef'):
+    _hex_to_nibble[_c] = _i
+    _hex_to_nibble[ord(chr(_c).upper())] = _i
+_nibble_to_hex = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+
+
+# Conversion helpers start
+def hex_to_array(hex_str):
+    return _hex_to_nibble[np.frombuffer(hex_str.encode('ascii'), dtype=np.uint8)].reshape(bitmap_height, bitmap_width)
+
+def array_to_hex(bitmap):
+    return _nibble_to_hex[bitmap.reshape(-1)].tobytes().decode('ascii')
+
+def rows_to_array(frame_rows):
+    return hex_to_array(''.join(row[1:-1] for row in frame_rows))
+
+def array_to_rows(bitmap):
+    hex_str = array_to_hex(bitmap)
+    return ['|{}|'.format(hex_str[i:i+bitmap_width]) for i in range(0, bitmap_width * bitmap_height, bitmap_width)]
+
+def bytes_to_array(data):
+    '''Unpack one or more packed bitmaps into a (N, 32, 128) array'''
+    packed = np.frombuffer(data, dtype=np.uint8)
+    bitmap = np.empty(packed.size * 2, dtype=np.uint8)
+    bitmap[0::2] = packed >> 4
+    bitmap[1::2] = packed & 0xf
+    return bitmap.reshape(-1, bitmap_height, bitmap_width)
+
+def array_to_bytes(bitmap):
+    flat = bitmap.reshape(-1)
+    return ((flat[0::2] << 4) | (flat[1::2] & 0xf)).astype(np.uint8).tobytes()
+
+def frames_to_array(frames):
+    '''Stack the bitmaps of a list of frame dicts (as in RunDmdAnimation.frames) into a (N, 32, 128) array'''
+    stacked = np.empty((len(frames), bitmap_height, bitmap_width), dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        stacked[i] = rows_to_array(frame['bitmap'])
+    return stacked
+# Conversion helpers end
+
+
+# Quantization start
+# The 15 real intensity levels in order, skipping the transparency nibble
+level_to_nibble = np.array([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 0xb, 0xc, 0xd, 0xe, 0xf], dtype=np.uint8)
+num_levels = len(level_to_nibble)
+nibble_to_level = np.zeros(16, dtype=np.uint8)
+nibble_to_level[level_to_nibble] = np.arange(num_levels, dtype=np.uint8)
+
+bucket_size = 256 // num_levels
+
+# 8x8 Bayer matrix, normalized to thresholds in (0, 1)
+_bayer = np.array([[0]], dtype=np.float32)
+for _i in range(3):
+    _bayer = np.block([[4 * _bayer, 4 * _bayer + 2], [4 * _bayer + 3, 4 * _bayer + 1]])
+bayer_thresholds = (_bayer + 0.5) / _bayer.size
+
+def quantize(grey, alpha=None, dither='none'):
+    '''
+    Map 8-bit greyscale (a single (H, W) image or a (N, H, W) stack) onto nibbles using 15 equal buckets.
+    Pixels with alpha == 0 become transparency.  dither can be 'none', 'bayer' (ordered) or
+    'floyd-steinberg' (error diffusion)
+    '''
+    grey = np.asarray(grey)
+    opaque = None if alpha is None else (np.asarray(alpha) != 0)
+    if dither == 'bayer':
+        height, width = grey.shape[-2:]
+        thresholds = np.tile(bayer_thresholds, (height // 8 + 1, width // 8 + 1))[:height, :width]
+        levels = np.clip(np.floor(grey / bucket_size + thresholds - 0.5), 0, num_levels - 1).astype(np.uint8)
+    elif dither == 'floyd-steinberg':
+        levels = _error_diffusion(grey, opaque)
+    else:
+        levels = np.minimum(grey.astype(np.uint16) // bucket_size, num_levels - 1)
+    nibbles = level_to_nibble[levels]
+    if opaque is not None:
+        nibbles[~opaque] = transparent
+    return nibbles
+
+def _error_diffusion(grey, opaque=None):
+    '''
+    Floyd-Steinberg over a wavefront: pixel (y, x) only depends on pixels with a smaller x + 2 * y, so
+    every pixel on a wavefront (and every frame of a stack) is processed in one array operation.  A
+    128x32 bitmap takes 190 steps instead of 4096.  Transparent pixels neither spread nor keep error
+    '''
+    single = grey.ndim == 2
+    grey = np.asarray(grey, dtype=np.float32).reshape((-1,) + grey.shape[-2:])
+    if opaque is not None:
+        opaque = opaque.reshape(grey.shape)
+    count, height, width = grey.shape
+    # One extra column on each side and one extra row at the bottom to catch error pushed off the edges
+    err = np.zeros((count, height + 1, width + 2), dtype=np.float32)
+    levels = np.empty(grey.shape, dtype=np.uint8)
+    all_rows = np.arange(height)
+    for t in range(width + 2 * (height - 1)):
+        cols = t - 2 * all_rows
+        valid = (cols >= 0) & (cols < width)
+        ys, xs = all_rows[valid], cols[valid]
+        # Clamped so a run of pure black or white cannot build up error that bleeds into the next region
+        value = np.clip(grey[:, ys, xs] + err[:, ys, xs + 1], 0, 255)
+        q = np.clip(np.rint(value * (num_levels - 1) / 255), 0, num_levels - 1)
+        levels[:, ys, xs] = q
+        # Error against the level's own intensity, so levels 0 and 14 stand for exactly 0 and 255
+        e = value - q * 255 / (num_levels - 1)
+        if opaque is not None:
+            e[~opaque[:, ys, xs]] = 0
+        err[:, ys, xs + 2] += e * (7 / 16)
+        err[:, ys + 1, xs] += e * (3 / 16)
+        err[:, ys + 1, xs + 1] += e * (5 / 16)
+        err[:, ys + 1, xs + 2] += e * (1 / 16)
+    return levels[0] if single else levels
+# Quantization end
+
+
+# Bitmap operations start
+# All of these take a single (32, 128) bitmap or a (N, 32, 128) stack and return a new array
+
+def crop(bitmaps, x_start=0, x_end=bitmap_width, y_start=0, y_end=bitmap_height):
+    '''Return the [y_start:y_end, x_start:x_end] region of every bitmap'''
+    return bitmaps[..., y_start:y_end, x_start:x_end].copy()
+
+def pad(bitmaps, x=None, y=None, fill=transparent):
+    '''Place smaller bitmaps on a full size canvas at (x, y), centered by default.  Anything off the canvas is clipped'''
+    height, width = bitmaps.shape[-2:]
+    if x is None:
+        x = (bitmap_width - width) // 2
+    if y is None:
+        y = (bitmap_height - height) // 2
+    canvas = np.full(bitmaps.shape[:-2] + (bitmap_height, bitmap_width), fill, dtype=np.uint8)
+    return overlay(canvas, bitmaps, x, y, transparent_key=None)
+
+def mask(bitmaps, x_start=0, x_end=bitmap_width, y_start=0, y_end=bitmap_height, fill=transparent):
+    '''Keep the given region in place and fill everything outside of it'''
+    return pad(crop(bitmaps, x_start, x_end, y_start, y_end), x_start, y_start, fill)
+
+def translate(bitmaps, dx=0, dy=0, fill=transparent, wrap=False):
+    '''Shift right by dx and down by dy.  Uncovered pixels are filled unless wrap is set'''
+    if wrap:
+        return np.roll(bitmaps, (dy, dx), axis=(-2, -1))
+    height, width = bitmaps.shape[-2:]
+    shifted = np.full_like(bitmaps, fill)
+    if abs(dx) >= width or abs(dy) >= height:
+        # Shifted completely out of view
+        return shifted
+    src_y, dst_y = slice(max(0, -dy), height - max(0, dy)), slice(max(0, dy), height - max(0, -dy))
+    src_x, dst_x = slice(max(0, -dx), width - max(0, dx)), slice(max(0, dx), width - max(0, -dx))
+    shifted[..., dst_y, dst_x] = bitmaps[..., src_y, src_x]
+    return shifted
+
+def flip(bitmaps, horizontal=True, vertical=False):
+    if horizontal:
+        bitmaps = bitmaps[..., :, ::-1]
+    if vertical:
+        bitmaps = bitmaps[..., ::-1, :]
+    return bitmaps.copy()
+
+def overlay(bitmaps, top, x=0, y=0, transparent_key=transparent):
+    '''
+    Composite top onto bitmaps with its top-left corner at (x, y).  top can be a single bitmap or one per
+    frame and does not need to be full size.  Pixels of top equal to transparent_key are see-through
+    '''
+    result = np.array(bitmaps, dtype=np.uint8, copy=True)
+    height, width = result.shape[-2:]
+    top_height, top_width = top.shape[-2:]
+    dst_y0, dst_y1 = max(0, y), min(height, y + top_height)
+    dst_x0, dst_x1 = max(0, x), min(width, x + top_width)
+    if dst_y0 >= dst_y1 or dst_x0 >= dst_x1:
+        return result
+    src = top[..., dst_y0-y:dst_y1-y, dst_x0-x:dst_x1-x]
+    dst = result[..., dst_y0:dst_y1, dst_x0:dst_x1]
+    if transparent_key is None:
+        dst[...] = src
+    else:
+        np.copyto(dst, np.broadcast_to(src, dst.shape), where=np.broadcast_to(src != transparent_key, dst.shape))
+    return result
+
+def remap(bitmaps, lut):
+    '''Replace every nibble n with lut[n].  lut is 16 entries, see invert_lut and mapping_lut'''
+    return np.asarray(lut, dtype=np.uint8)[bitmaps]
+
+def identity_lut():
+    return np.arange(16, dtype=np.uint8)
+
+def invert_lut():
+    '''Reverse the intensity levels, transparency is left alone'''
+    lut = identity_lut()
+    lut[level_to_nibble] = level_to_nibble[::-1]
+    return lut
+
+def mapping_lut(mapping):
+    '''Build a LUT from a {nibble : nibble} dict, unmapped nibbles are left alone'''
+    lut = identity_lut()
+    for src, dst in mapping.items():
+        lut[src] = dst
+    return lut
+# Bitmap operations end
+
+
+# Comparison helpers start
+def pixel_differences(bitmaps):
+    '''Return a (N, N) matrix with the number of differing pixels between every pair of a (N, 32, 128) stack'''
+    count = len(bitmaps)
+    flat = bitmaps.reshape(count, -1)
+    diffs = np.zeros((count, count), dtype=np.int32)
+    for i in range(count - 1):
+        diffs[i, i+1:] = np.count_nonzero(flat[i+1:] != flat[i], axis=1)
+    return diffs + diffs.T
+# Comparison helpers end
+
+
+# Bitmap reduction start
+def cluster_bitmaps(bitmaps, max_bitmaps=None, max_error=None, weights=None):
+    '''
+    Group a (N, 32, 128) stack of distinct bitmaps by the number of differing pixels, merging the closest pair of
+    clusters (complete linkage, so every pair inside a cluster is within the merge distance) until there are at most
+    max_bitmaps clusters and no two clusters are within max_error pixels.  Each cluster is represented by its medoid,
+    the member closest to the others, where weights (e.g. how many frames show each bitmap) make often shown bitmaps
+    more likely to be picked.  Returns (labels, representatives): the cluster of every bitmap and the index of the
+    bitmap representing each cluster
+    '''
+    count = len(bitmaps)
+    weights = np.ones(count) if weights is None else np.asarray(weights, dtype=np.float64)
+    diffs = pixel_differences(bitmaps) if count else np.zeros((0, 0), dtype=np.int32)
+    linkage = diffs.astype(np.float64)
+    np.fill_diagonal(linkage, np.inf)
+    members = [[i] for i in range(count)]
+    active = count
+    while active > 1:
+        i, j = divmod(int(np.argmin(linkage)), count)
+        over_budget = max_bitmaps != None and active > max_bitmaps
+        within_error = max_error != None and linkage[i, j] <= max_error
+        if not (over_budget or within_error):
+            break
+        # Merge cluster j into cluster i
+        linkage[i] = np.maximum(linkage[i], linkage[j])
+        linkage[:, i] = linkage[i]
+        linkage[i, i] = np.inf
+        linkage[j] = np.inf
+        linkage[:, j] = np.inf
+        members[i] += members[j]
+        members[j] = None
+        active -= 1
+
+    labels = np.empty(count, dtype=np.int32)
+    representatives = []
+    for cluster in [m for m in members if m != None]:
+        cost = diffs[np.ix_(cluster, cluster)] @ weights[cluster]
+        labels[cluster] = len(representatives)
+        representatives.append(cluster[int(np.argmin(cost))])
+    return labels, np.array(representatives, dtype=np.int32)
+
+def reduce_bitmaps(bitmaps, max_bitmaps=None, max_error=None):
+    '''
+    Replace the bitmaps of a (N, 32, 128) stack of frames with cluster representatives (see cluster_bitmaps) so at
+    most max_bitmaps distinct bitmaps are left.  Returns (new stack, report) where the report has the distinct bitmap
+    counts before and after and the number of pixels changed per frame (max and mean)
+    '''
+    unique, inverse, counts = np.unique(bitmaps.reshape(len(bitmaps), bitmap_height * bitmap_width), axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    unique = unique.reshape(-1, bitmap_height, bitmap_width)
+    if len(unique) == 0 or (max_error == None and max_bitmaps != None and len(unique) <= max_bitmaps):
+        # Nothing to merge (no frames, or already within budget), every bitmap represents itself
+        labels, representatives = np.arange(len(unique), dtype=np.int32), np.arange(len(unique), dtype=np.int32)
+    else:
+        labels, representatives = cluster_bitmaps(unique, max_bitmaps, max_error, counts)
+    reduced = unique[representatives[labels[inverse]]]
+    changed = np.count_nonzero((reduced != bitmaps).reshape(len(bitmaps), bitmap_height * bitmap_width), axis=1)
+    report = {
+        'bitmaps_before' : len(unique),
+        'bitmaps_after' : len(representatives),
+        'frames_changed' : int(np.count_nonzero(changed)),
+        'max_error_pixels' : int(changed.max()) if len(changed) else 0,
+        'mean_error_pixels' : float(changed.mean()) if len(changed) else 0.0
+    }
+    return reduced, report
+# Bitmap reduction end
+
+
+# Rendering helpers start
+def to_rgba(bitmaps, palette=palette_rgba):
+    return palette[bitmaps]
+
+def upscale(bitmaps, scale):
+    if scale == 1:
+        return bitmaps
+    return np.repeat(np.repeat(bitmaps, scale, axis=-2), scale, axis=-1)
+
+def contact_sheet(bitmaps, columns=8, gap=1):
+    '''Tile a (N, H, W) stack into one (rows*H, columns*W) array with transparent gaps between tiles'''
+    count, height, width = bitmaps.shape
+    columns = max(1, min(columns, count))
+    rows = (count + columns - 1) // columns
+    sheet = np.full((rows * (height + gap) - gap, columns * (width + gap) - gap), transparent, dtype=bitmaps.dtype)
+    for i in range(count):
+        y = (i // columns) * (height + gap)
+        x = (i % columns) * (width + gap)
+        sheet[y:y+height, x:x+width] = bitmaps[i]
+    return sheet
+# Rendering helpers end
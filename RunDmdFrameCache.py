@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+'''
+NOTES:
+On-disk cache of decoded source frames for the converters (gif_to_json.py, video_to_json.py).  Decoding a long video is by
+far the slowest part of a conversion, and it is repeated every time a crop, frame range or invert setting is tried.  The
+cache decodes the whole source once, downscales every frame to an intermediate width and stores it as greyscale ('L') or
+greyscale plus alpha ('LA'), so later runs only crop, resize and quantize.
+
+Each entry is two files in the cache directory, named after a key built from the SHA-1 of the source file and the decode
+parameters:
+    <key>.frames    raw uint8 pixels, (frames, height, width) or (frames, height, width, 2), memory mapped when read
+    <key>.json      metadata: source name and size, cached size, mode and per-frame durations in ms
+
+When the .frames files add up to more than the size limit, the least recently used entries are removed first.
+'''
+
+import os
+import json
+import hashlib
+import numpy as np
+from PIL import Image
+import RunDmdImage
+
+logger = RunDmdImage.logger
+
+
+class RunDmdFrameCache(object):
+    # Bump when the stored layout changes so old entries are not picked up
+    cache_version = 1
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def source_key(self, fname, **params):
+        '''
+        Key from the source file contents and the decode parameters, so a renamed file still hits and an edited one
+        does not
+        '''
+        digest = hashlib.sha1()
+        with open(fname, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b''):
+                digest.update(chunk)
+        params = dict(params, version=self.cache_version)
+        return hashlib.sha1('{}:{}'.format(digest.hexdigest(), json.dumps(params, sort_keys=True)).encode('ascii')).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + '.frames', base + '.json'
+
+    def load(self, fname, cache_width, decoder, mode='L'):
+        '''
+        Return the cached frames of fname, decoding it first if there is no entry.  decoder is a callable returning an
+        iterable of (PIL image, duration in ms) for every frame of the source.  The result is a dict with 'frames' (a
+        read-only memory map), 'durations', 'mode', 'source_width' and 'source_height'
+        '''
+        key = self.source_key(fname, cache_width=cache_width, mode=mode)
+        frames_path, meta_path = self._paths(key)
+        if os.path.exists(frames_path) and os.path.exists(meta_path):
+            logger.info('Using cached frames for {}'.format(fname))
+            os.utime(frames_path)
+        else:
+            logger.info('Decoding {} into the frame cache'.format(fname))
+            self.store(key, fname, cache_width, decoder(), mode)
+            self.evict(keep=key)
+
+        with open(meta_path, 'r') as fh:
+            meta = json.load(fh)
+        shape = tuple(meta['shape'])
+        if shape[0] == 0:
+            frames = np.zeros(shape, dtype=np.uint8)
+        else:
+            frames = np.memmap(frames_path, dtype=np.uint8, mode='r', shape=shape)
+        return {'frames' : frames, 'durations' : meta['durations'], 'mode' : meta['mode'],
+                'source_width' : meta['source_width'], 'source_height' : meta['source_height']}
+
+    def store(self, key, fname, cache_width, images, mode):
+        frames_path, meta_path = self._paths(key)
+        # Write under temporary names so an interrupted decode never leaves a truncated entry behind
+        tmp_suffix = '.{}.tmp'.format(os.getpid())
+        durations = []
+        source_size = (0, 0)
+        cached_size = (0, 0)
+        with open(frames_path + tmp_suffix, 'wb') as fh:
+            for image, duration in images:
+                if len(durations) == 0:
+                    source_size = image.size
+                    width = min(cache_width, source_size[0])
+                    cached_size = (width, max(1, round(source_size[1] * width / source_size[0])))
+                if image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+                    image = image.convert('RGBA')
+                fh.write(np.asarray(image.resize(cached_size).convert(mode)).tobytes())
+                durations.append(duration)
+        shape = [len(durations), cached_size[1], cached_size[0]] + ([2] if mode == 'LA' else [])
+        meta = {'source' : os.path.basename(fname), 'source_width' : source_size[0], 'source_height' : source_size[1],
+                'mode' : mode, 'shape' : shape, 'durations' : durations}
+        with open(meta_path + tmp_suffix, 'w') as fh:
+            fh.write(json.dumps(meta, indent=2))
+        os.replace(frames_path + tmp_suffix, frames_path)
+        os.replace(meta_path + tmp_suffix, meta_path)
+        logger.info('Cached {} frames of {} at {}x{}'.format(len(durations), fname, cached_size[0], cached_size[1]))
+
+    def evict(self, keep=None):
+        '''Remove the least recently used entries until the cached frames fit in max_size bytes'''
+        entries = []
+        for f in os.listdir(self.cache_dir):
+            key, ext = os.path.splitext(f)
+            if ext != '.frames':
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, f))
+            entries.append((stat.st_mtime, stat.st_size, key))
+        total_size = sum(size for mtime, size, key in entries)
+        for mtime, size, key in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            for path in self._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            total_size -= size
+            logger.info('Evicted cached frames {}'.format(key))
+
+    @staticmethod
+    def images(cached):
+        '''Yield (PIL image, duration) for every cached frame'''
+        for frame, duration in zip(cached['frames'], cached['durations']):
+            yield Image.fromarray(np.asarray(frame)), duration
+
+    @staticmethod
+    def crop_box(cached, left, top, right, bottom):
+        '''Scale a crop box given in source pixels to the cached resolution'''
+        shape = cached['frames'].shape
+        x_scale = shape[2] / cached['source_width'] if cached['source_width'] else 1
+        y_scale = shape[1] / cached['source_height'] if cached['source_height'] else 1
+        return (round(left * x_scale), round(top * y_scale), round(right * x_scale), round(bottom * y_scale))
@@ -18,8 +18,17 @@ from struct import pack, unpack
 from enum import Enum
 import sys
 import os
+import re
+import fnmatch
 import logging
 import json
+import hashlib
+import shutil
+import decimal
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
@@ -35,6 +44,8 @@ class BinaryHandler(object):
             width = params['width']
             if 'type' in params and params['type'] == 'string':
                 field_val = unpack('>{}s'.format(width), data[cur_offset:cur_offset+width])[0].strip(b'\x00').decode('ascii')
+            elif 'type' in params and params['type'] == 'bytes':
+                field_val = bytes(data[cur_offset:cur_offset+width])
             else:
                 field_bytes = unpack('>{}'.format('B' * width), data[cur_offset:cur_offset+width])
                 field_val = 0
@@ -70,6 +81,8 @@ class BinaryHandler(object):
             if 'type' in params:
                 if params['type'] == 'string':
                     byte_vals = pack('>{}s'.format(width), data[field].encode('ascii'))
+                elif params['type'] == 'bytes':
+                    byte_vals = bytes(field_val[:width]).ljust(width, b'\x00')
                 elif params['type'] == 'enum':
                     for enum_key in params['enum_vals']:
                         if enum_key == field_val:
@@ -95,20 +108,61 @@ class RunDmdHeader(object):
     block_size =                512
     image_marker =              'DGD'
     startup_pic_size =          0xc600
+    startup_pic_width =         128 # Only used to lay the raw data out as an image for the PNG sidecar
     main_header_format = [ # list in header byte order and width is in bytes
         ('marker',              {'width' : 3, 'type' : 'string'}),
         ('total_animations',    {'width' : 2}),
-        ('unknown_field1',      {'width' : 16}),
+        ('unknown_field1',      {'width' : 16, 'type' : 'bytes'}),
         ('enabled_animations',  {'width' : 2}),
-        ('unknown_field2',      {'width' : 472}),
+        ('unknown_field2',      {'width' : 472, 'type' : 'bytes'}),
         ('version',             {'width' : 4, 'type' : 'string'}),
-        ('unknown_field3',      {'width' : 13}),
-        ('startup_picture',     {'width' : startup_pic_size})
+        ('unknown_field3',      {'width' : 13, 'type' : 'bytes'}),
+        ('startup_picture',     {'width' : startup_pic_size, 'type' : 'bytes'})
     ]
+    bytes_fields = {field : params['width'] for field, params in main_header_format if params.get('type') == 'bytes'}
 
     def __init__(self):
         self.header = {}
     
+    # Helper methods start
+    def _parse_json_int(self, int_str):
+        # Older header.json files hold the opaque fields as huge decimal integers, which int() refuses past
+        # sys.get_int_max_str_digits().  Decimal has no such limit
+        if len(int_str) < 4000:
+            return int(int_str)
+        return int(decimal.Decimal(int_str))
+    # Helper methods end
+    
+    # Startup picture handling start
+    def load_startup_picture(self, fname):
+        '''Load the startup picture from a raw (.bin) or PNG (.png) sidecar written by build_startup_picture'''
+        if os.path.splitext(fname)[1].lower() == '.png':
+            from PIL import Image
+            # One nibble per pixel, stored as nibble * 17 so the picture is viewable and editable as greyscale
+            nibbles = [(v + 8) // 17 for v in Image.open(fname).convert('L').getdata()]
+            data = bytes((nibbles[i] << 4) | nibbles[i+1] for i in range(0, len(nibbles) - 1, 2))
+        else:
+            with open(fname, 'rb') as fh:
+                data = fh.read()
+        if len(data) != self.startup_pic_size:
+            logger.warning('Startup picture {} is 0x{:x} bytes, expected 0x{:x}'.format(fname, len(data), self.startup_pic_size))
+        self.header['startup_picture'] = data
+    
+    def build_startup_picture(self, fmt='bin'):
+        data = self.header['startup_picture']
+        if fmt == 'png':
+            from PIL import Image
+            import io
+            pixels = bytearray(len(data) * 2)
+            pixels[0::2] = bytes((b >> 4) * 17 for b in data)
+            pixels[1::2] = bytes((b & 0xf) * 17 for b in data)
+            img = Image.frombytes('L', (self.startup_pic_width, len(pixels) // self.startup_pic_width), bytes(pixels))
+            out = io.BytesIO()
+            img.save(out, format='PNG')
+            return out.getvalue()
+        return data
+    # Startup picture handling end
+    
     # Main loaders and builders start
     def load_binary_data(self, data):
         self.header = BinaryHandler().parse_binary(self.main_header_format, data)
@@ -116,16 +170,36 @@ class RunDmdHeader(object):
             logger.fatal('Binary did not have the correct marker')
             return False
 
-    def load_json_data(self, json_data):
-        data = json.loads(json_data)
+    def load_json_data(self, json_data, base_dir=None):
+        '''
+        Opaque fields are hex strings, except for startup_picture which names a sidecar file (relative to
+        base_dir).  Integers from older header.json files are still accepted
+        '''
+        data = json.loads(json_data, parse_int=self._parse_json_int)
+        for field, width in self.bytes_fields.items():
+            if field not in data:
+                continue
+            val = data.pop(field)
+            if isinstance(val, int):
+                self.header[field] = val.to_bytes(width, 'big')
+            elif field == 'startup_picture':
+                self.load_startup_picture(os.path.join(base_dir or '', val))
+            else:
+                self.header[field] = bytes.fromhex(val)
         self.header.update(data)
     
     def build_binary_data(self):
         binary_data = BinaryHandler().create_binary(self.main_header_format, self.header)
         return binary_data
     
-    def build_json_data(self):
-        return json.dumps(self.header, indent=2)
+    def build_json_data(self, startup_picture_file='startup_picture.bin'):
+        '''The startup picture itself is not included, write build_startup_picture() to startup_picture_file'''
+        data = dict(self.header)
+        for field in self.bytes_fields:
+            if field in data:
+                data[field] = data[field].hex()
+        data['startup_picture'] = startup_picture_file
+        return json.dumps(data, indent=2)
     # Main loaders and builders end
 
 
@@ -149,6 +223,45 @@ def RunDmdDurationDecode(duration_enc):
     bucket = rundmd_duration_buckets[(duration_enc >> 6) & 0x3]
     return (duration_enc & 0x3f) * bucket[0]
 
+def RunDmdFieldOffset(binary_format, field_name):
+    # Byte offset of a field within one of the binary format lists
+    offset = 0
+    for field, params in binary_format:
+        if field == field_name:
+            return offset
+        offset += params['width']
+    raise KeyError(field_name)
+
+def RunDmdTitleName(full_name):
+    # Animation names are "<TITLE>_<NNN>", the title group is everything before the last underscore
+    return full_name[:full_name.rfind('_')]
+
+def RunDmdNameFilter(include=None, exclude=None, use_regex=False):
+    '''
+    Build a predicate that selects animations by name.  Each pattern is matched against both the full
+    animation name (e.g. CONGO_029) and its title group (e.g. CONGO).  Patterns are shell style globs
+    unless use_regex is set.  An animation is selected if it matches any include pattern (or there are
+    no include patterns) and does not match any exclude pattern
+    '''
+    def compile_patterns(patterns):
+        if not patterns:
+            return []
+        if use_regex:
+            return [re.compile(p).fullmatch for p in patterns]
+        return [re.compile(fnmatch.translate(p)).match for p in patterns]
+
+    include_matchers = compile_patterns(include)
+    exclude_matchers = compile_patterns(exclude)
+
+    def name_filter(full_name):
+        names = (full_name, RunDmdTitleName(full_name))
+        if include_matchers and not any(m(n) for m in include_matchers for n in names):
+            return False
+        if any(m(n) for m in exclude_matchers for n in names):
+            return False
+        return True
+    return name_filter
+
 class RunDmdAnimation(object):
     block_size =                512
     bitmap_width =              128
@@ -181,11 +294,21 @@ class RunDmdAnimation(object):
         ('bitmap_num',          {'width' : 1}),
         ('duration',            {'width' : 1, 'type' : 'function', 'encode' : RunDmdDurationEncode, 'decode' : RunDmdDurationDecode})
     ]
+    # Header fields that hold bitmap counts or numbers, and so change whenever the stored bitmaps do
+    bitmap_storage_keys =       ['num_bitmaps', 'clock_start_frame', 'clock_end_frame']
+    user_header_keys =          ['clock_type', 'intro_transition', 'outro_transition', 'clock_size', 'clock_position_x', 'clock_position_y', 'clock_start_frame', 'clock_end_frame']
+    # encode_binary_frames() results shared by every animation and thread, keyed by frames_hash() and bounded in bytes
+    encode_cache =              OrderedDict()
+    encode_cache_lock =         threading.Lock()
+    encode_cache_bytes =        0
+    encode_cache_max_bytes =    256 * 1024 * 1024
 
 
     def __init__(self):
         self.header = {}
+        self.header_format = 'system' # 'system' when the clock fields hold binary bitmap numbers, 'user' when they hold frame numbers
         self.frames = []
+        # Bitmap mapping of the binary data the frames were loaded from (0-based, -1 is a transparent frame)
         self.frame_to_bitmap = {}
         self.bitmap_to_frames = {}
     
@@ -204,12 +327,33 @@ class RunDmdAnimation(object):
                 return False
             frame += row[1:-1]
         return frame  
+    
+    @staticmethod
+    def _diff_bytes(expected, actual):
+        '''Return (offset of the first differing byte, number of differing bytes), counting a length difference as differing'''
+        first = None
+        count = abs(len(expected) - len(actual))
+        chunk = 4096
+        for start in range(0, min(len(expected), len(actual)), chunk):
+            a, b = expected[start:start+chunk], actual[start:start+chunk]
+            if a == b:
+                continue
+            # The last chunk of the shorter blob can be cut short, the length difference is already counted
+            for i in range(min(len(a), len(b))):
+                if a[i] != b[i]:
+                    count += 1
+                    if first == None:
+                        first = start + i
+        if first == None and len(expected) != len(actual):
+            first = min(len(expected), len(actual))
+        return (first, count)
     # Helper methods end
     
 
     # Animation header handling start
     def load_binary_animation_header(self, data):
         self.header = BinaryHandler().parse_binary(self.animation_header_format, data)
+        self.header_format = 'system'
 
     def load_json_animation_header(self, json_data):
         dummy_header = bytearray(52)
@@ -220,55 +364,95 @@ class RunDmdAnimation(object):
         self.header['display_width'] = 128
         self.header['display_height'] = 32
         self.header.update(data)
+        self.header_format = 'user'
         if self.header['clock_start_frame'] < 0:
             self.header['clock_start_frame'] = 0
         if self.header['clock_end_frame'] >= self.header['total_frames']:
             self.header['clock_end_frame'] = self.header['total_frames'] - 1
     
-    def build_binary_animation_header(self):
-        binary_data = BinaryHandler().create_binary(self.animation_header_format, self.header)
+    def build_binary_animation_header(self, header=None):
+        binary_data = BinaryHandler().create_binary(self.animation_header_format, self.header if header == None else header)
         padding = bytearray(self.block_size - len(binary_data))
         return binary_data + padding
     
     def build_json_animation_header(self):
         return json.dumps(self.header, indent=2)
 
-    def animation_header_user_format(self):
-        logger.debug('Sanitizing header for user consumption')
-        logger.debug('Original header was: {}'.format(self.header))
+    def _clock_frames(self, header):
+        '''
+        Return (clock_start_frame, clock_end_frame, clock_type) of header as frame numbers.  A clock field of 0 in a
+        system format header comes back as None so it can be written back unchanged
+        '''
+        if self.header_format == 'user':
+            return (header['clock_start_frame'], header['clock_end_frame'], header['clock_type'])
         
-        start_bitmap = self.header['clock_start_frame'] - 1
+        clock_type = header['clock_type']
+        start_bitmap = header['clock_start_frame'] - 1
         if start_bitmap == -1:
             logger.info('Converting clock start to first frame number')
-            self.header['clock_start_frame'] = 0
+            start_frame = None
         elif start_bitmap not in self.bitmap_to_frames:
             logger.warning('Header requested start bitmap {} (0-based), but this was never referenced. Forcing no clock'.format(start_bitmap))
-            self.header['clock_start_frame'] = 0
-            self.header['clock_type'] = 'NoClock'
+            start_frame = None
+            clock_type = 'NoClock'
         else:
             logger.debug('Start bitmap is sane.  Converting from {} to {} (both 0-based)'.format(start_bitmap, self.bitmap_to_frames[start_bitmap][0]))
-            self.header['clock_start_frame'] = self.bitmap_to_frames[start_bitmap][0]
+            start_frame = self.bitmap_to_frames[start_bitmap][0]
         
-        end_bitmap = self.header['clock_end_frame'] - 1
+        end_bitmap = header['clock_end_frame'] - 1
         if end_bitmap == -1:
             logger.info('Converting clock end to last frame number')
-            self.header['clock_end_frame'] = len(self.frames) - 1
+            end_frame = None
         elif end_bitmap not in self.bitmap_to_frames:
             logger.warning('Header requested end bitmap {} (0-based), but this was never referenced. Forcing display until end'.format(end_bitmap))
-            self.header['clock_end_frame'] = len(self.frames) - 1
+            end_frame = None
         else:
             logger.debug('End bitmap is sane.  Converting from {} to {}'.format(end_bitmap, self.bitmap_to_frames[end_bitmap][0]))
-            self.header['clock_end_frame'] = self.bitmap_to_frames[end_bitmap][0]
-        
-        user_keys = ['clock_type', 'intro_transition', 'outro_transition', 'clock_size', 'clock_position_x', 'clock_position_y', 'clock_start_frame', 'clock_end_frame']
-        for key in list(self.header):
-            if key not in user_keys:
-                self.header.pop(key)
+            end_frame = self.bitmap_to_frames[end_bitmap][0]
+        return (start_frame, end_frame, clock_type)
+
+    def encode_json_header(self, header=None, total_frames=None):
+        '''
+        Return a new header dict in user format (only the user editable keys, clock fields as frame numbers).  Does not
+        modify the animation.  total_frames overrides len(self.frames), for frames that are streamed out instead
+        '''
+        header = self.header if header == None else header
+        total_frames = len(self.frames) if total_frames == None else total_frames
+        logger.debug('Sanitizing header for user consumption')
+        logger.debug('Original header was: {}'.format(header))
+        start_frame, end_frame, clock_type = self._clock_frames(header)
+        user_header = {key : header[key] for key in self.user_header_keys}
+        user_header['clock_type'] = clock_type
+        user_header['clock_start_frame'] = 0 if start_frame == None else start_frame
+        user_header['clock_end_frame'] = total_frames - 1 if end_frame == None else end_frame
+        return user_header
+
+    def encode_binary_header(self, header=None, encoded=None):
+        '''
+        Return a new header dict in system format matching encode_binary_frames(): clock fields as 1-based bitmap numbers,
+        total_frames and num_bitmaps from the frames.  encoded is an encode_binary_frames() result computed earlier, so
+        the frames are not encoded again.  Does not modify the animation
+        '''
+        header = dict(self.header if header == None else header)
+        frames_binary, frame_to_bitmap = self.encode_binary_frames() if encoded == None else encoded
+        start_frame, end_frame, clock_type = self._clock_frames(header)
+        header['clock_type'] = clock_type
+        for key, frame_num in [('clock_start_frame', start_frame), ('clock_end_frame', end_frame)]:
+            if frame_num == None or len(frame_to_bitmap) == 0:
+                header[key] = 0
+            else:
+                header[key] = frame_to_bitmap[min(max(frame_num, 0), len(frame_to_bitmap) - 1)]
+        header['total_frames'] = len(frame_to_bitmap)
+        header['num_bitmaps'] = (len(frames_binary) - self.block_size) // self.bitmap_size
+        return header
+
+    def animation_header_user_format(self):
+        self.header = self.encode_json_header()
+        self.header_format = 'user'
 
     def animation_header_system_format(self):
-        params = ['clock_start_frame', 'clock_end_frame']
-        for param in params:
-            self.header[param] = self.frame_to_bitmap[self.header[param]] + 1
+        self.header = self.encode_binary_header()
+        self.header_format = 'system'
     # Animation header handling end
     
     
@@ -297,12 +481,40 @@ class RunDmdAnimation(object):
             frame_rows_list = self._frame_to_rows(hex_str)
             self.frames.append({'duration' : frame_to_bitmap_info['duration'], 'bitmap' : frame_rows_list})
         #logger.debug('{}'.format(sorted(referenced_bitmaps)))
-        for i in range(1, self.header['num_bitmaps'] + 1):
-            if i not in referenced_bitmaps:
-                logger.warn('Bitmap number {} is unreferenced in {}'.format(i, self.header['name']))
-                return False
+        unreferenced = [i for i in range(1, self.header['num_bitmaps'] + 1) if i not in referenced_bitmaps]
+        if len(unreferenced):
+            logger.debug('Bitmap numbers {} are unreferenced in {}'.format(unreferenced, self.header['name']))
+            return False
         return True
     
+    def analyze_binary_frames(self, data):
+        '''
+        Check the frame data of a binary animation without decoding any bitmaps.  Every bitmap is hashed
+        once.  Returns a dict with the 1-based numbers of unreferenced bitmaps, groups of byte-identical
+        bitmaps and frame references to bitmaps that do not exist
+        '''
+        referenced = set()
+        missing = []
+        for frame_num in range(self.header['total_frames']):
+            bitmap_num = data[frame_num*2]
+            if bitmap_num > self.header['num_bitmaps']:
+                missing.append((frame_num, bitmap_num))
+            referenced.add(bitmap_num)
+        
+        by_hash = {}
+        for i in range(self.header['num_bitmaps']):
+            bitmap_addr = i * self.bitmap_size + self.block_size
+            digest = hashlib.sha1(data[bitmap_addr:bitmap_addr+self.bitmap_size]).digest()
+            by_hash.setdefault(digest, []).append(i + 1)
+        
+        return {
+            'name' : self.header['name'],
+            'num_bitmaps' : self.header['num_bitmaps'],
+            'unreferenced' : [i for i in range(1, self.header['num_bitmaps'] + 1) if i not in referenced],
+            'identical' : [group for group in by_hash.values() if len(group) > 1],
+            'missing' : missing
+        }
+    
     def load_json_frames(self, json_data):
         data = json.loads(json_data)
         self.frames = data
@@ -317,10 +529,39 @@ class RunDmdAnimation(object):
                 if len(row) != self.bitmap_width + 2:
                     logger.error('Row {} of frame {} is not the correct width'.format(j, i))
     
-    def build_binary_frames(self):
+    def frames_hash(self):
+        '''SHA-1 of the frame durations and bitmaps, the only inputs of encode_binary_frames()'''
+        digest = hashlib.sha1()
+        for frame_info in self.frames:
+            digest.update('{}|'.format(frame_info['duration']).encode('ascii'))
+            for row in frame_info['bitmap']:
+                digest.update(row.encode('ascii'))
+        return digest.hexdigest()
+    
+    def content_hash(self):
+        '''SHA-1 of everything the encoders read.  Animations with the same hash encode to the same data'''
+        digest = hashlib.sha1(self.frames_hash().encode('ascii'))
+        digest.update(self.header_format.encode('ascii'))
+        digest.update(json.dumps(self.header, sort_keys=True).encode('utf-8'))
+        if self.header_format == 'system':
+            digest.update(json.dumps(sorted(self.bitmap_to_frames.items())).encode('ascii'))
+        return digest.hexdigest()
+    
+    def encode_binary_frames(self):
+        '''
+        Return (frames_binary, frame_to_bitmap): the frame table and deduplicated bitmaps as bytes, and the 1-based
+        bitmap number of every frame as a tuple.  Does not modify the animation, and results are memoized in
+        encode_cache so repeated and concurrent calls are cheap and safe
+        '''
+        key = self.frames_hash()
+        with self.encode_cache_lock:
+            if key in self.encode_cache:
+                self.encode_cache.move_to_end(key)
+                return self.encode_cache[key]
+        
         known_bitmaps = {}
         animation_binary = bytearray(self.block_size)
-
+        frame_to_bitmap = []
         for i, frame_info in enumerate(self.frames):
             bitmap = self._rows_to_frame(frame_info['bitmap'])
             if bitmap not in known_bitmaps:
@@ -328,20 +569,121 @@ class RunDmdAnimation(object):
                 known_bitmaps[bitmap] = len(known_bitmaps) + 1
                 bitmap_binary = bytearray.fromhex(bitmap)
                 animation_binary += bitmap_binary
-            self.frame_to_bitmap[i] = known_bitmaps[bitmap]
-            if known_bitmaps[bitmap] not in self.bitmap_to_frames:
-                self.bitmap_to_frames[known_bitmaps[bitmap]] = [i]
-            else:
-                self.bitmap_to_frames[known_bitmaps[bitmap]].append(i)
+            frame_to_bitmap.append(known_bitmaps[bitmap])
             tmp_info = BinaryHandler().create_binary(self.frames_header_format, {'duration' : frame_info['duration'], 'bitmap_num' : known_bitmaps[bitmap]})
             animation_binary[i*2:i*2+2] = tmp_info
-        return animation_binary
+        result = (bytes(animation_binary), tuple(frame_to_bitmap))
+        
+        with self.encode_cache_lock:
+            if key not in self.encode_cache:
+                self.encode_cache[key] = result
+                RunDmdAnimation.encode_cache_bytes += len(result[0])
+            while RunDmdAnimation.encode_cache_bytes > self.encode_cache_max_bytes and len(self.encode_cache) > 1:
+                old_key, old_result = self.encode_cache.popitem(last=False)
+                RunDmdAnimation.encode_cache_bytes -= len(old_result[0])
+        return result
+    
+    def build_binary_frames(self):
+        return bytearray(self.encode_binary_frames()[0])
     
     def build_json_frames(self):
         return json.dumps(self.frames, indent=2)
+    
+    def get_bitmaps(self):
+        '''Return the frame bitmaps as a (N, 32, 128) nibble array (see RunDmdBitmap)'''
+        import RunDmdBitmap
+        return RunDmdBitmap.frames_to_array(self.frames)
+    
+    def set_bitmaps(self, bitmaps):
+        import RunDmdBitmap
+        for frame, bitmap in zip(self.frames, bitmaps):
+            frame['bitmap'] = RunDmdBitmap.array_to_rows(bitmap)
+    
+    def apply_bitmap_op(self, op, *args, **kwargs):
+        '''Run a RunDmdBitmap operation (or any function of a (N, 32, 128) array) over every frame at once'''
+        self.set_bitmaps(op(self.get_bitmaps(), *args, **kwargs))
+    
+    def reduce_bitmaps(self, max_bitmaps=None, max_error=None):
+        '''
+        Merge similar bitmaps (see RunDmdBitmap.reduce_bitmaps) and point every frame at its cluster representative,
+        so at most max_bitmaps distinct bitmaps are stored and/or bitmaps within max_error pixels of each other are
+        shared.  Returns the report, with the bytes saved in the frame blob added
+        '''
+        import RunDmdBitmap
+        reduced, report = RunDmdBitmap.reduce_bitmaps(self.get_bitmaps(), max_bitmaps, max_error)
+        if report['bitmaps_after'] != report['bitmaps_before']:
+            self.set_bitmaps(reduced)
+        report['bytes_saved'] = (report['bitmaps_before'] - report['bitmaps_after']) * self.bitmap_size
+        return report
     # Frame handling end
     
 
+    # Playback profiling start
+    def binary_frame_table(self, data):
+        '''(bitmap_num, duration_ms) for every frame from the frame table at the start of a binary frame blob'''
+        frame_table = []
+        for frame_num in range(self.header['total_frames']):
+            info = BinaryHandler().parse_binary(self.frames_header_format, data[frame_num*2:frame_num*2+2])
+            frame_table.append((info['bitmap_num'], info['duration']))
+        return frame_table
+    
+    def playback_frame_table(self):
+        '''
+        (bitmap_num, duration_ms) for every frame as the device would play the frames: bitmap numbers as
+        encode_binary_frames() assigns them and durations after going through the binary encoding
+        '''
+        frame_to_bitmap = self.encode_binary_frames()[1]
+        return [(bitmap_num, RunDmdDurationDecode(RunDmdDurationEncode(frame['duration']))) for bitmap_num, frame in zip(frame_to_bitmap, self.frames)]
+    
+    def playback_profile(self, frame_table, window_ms=1000, source_durations=None):
+        '''
+        Estimate how hard an animation is on the card during playback.  Every frame that shows a different bitmap than
+        the frame before it costs one bitmap read at the moment it is shown (transparent frames, bitmap 0, cost
+        nothing).  Returns the runtime, the average read rate and the peak read rate over any window_ms window (or
+        over the whole runtime if it is shorter), in bytes per second.  With source_durations (the JSON durations),
+        the error that duration encoding introduces is reported as well
+        '''
+        reads = []
+        cur_ms = 0
+        prev_bitmap = None
+        for bitmap_num, duration in frame_table:
+            if bitmap_num != 0 and bitmap_num != prev_bitmap:
+                reads.append(cur_ms)
+            prev_bitmap = bitmap_num
+            cur_ms += duration
+        runtime_ms = cur_ms
+        
+        # Sliding window over the read times, anchored at each read
+        peak_reads = 0
+        peak_start_ms = 0
+        window = min(window_ms, runtime_ms) if runtime_ms > 0 else window_ms
+        end = 0
+        for start in range(len(reads)):
+            while end < len(reads) and reads[end] < reads[start] + window:
+                end += 1
+            if end - start > peak_reads:
+                peak_reads = end - start
+                peak_start_ms = reads[start]
+        
+        profile = {
+            'name' : self.header.get('name', ''),
+            'frames' : len(frame_table),
+            'bitmaps' : len(set(bitmap_num for bitmap_num, duration in frame_table if bitmap_num != 0)),
+            'runtime_ms' : runtime_ms,
+            'bitmap_reads' : len(reads),
+            'average_bytes_per_s' : len(reads) * self.bitmap_size * 1000 // runtime_ms if runtime_ms > 0 else 0,
+            'peak_bytes_per_s' : peak_reads * self.bitmap_size * 1000 // window if window > 0 else 0,
+            'peak_start_ms' : peak_start_ms
+        }
+        if source_durations != None:
+            errors = [duration - source for (bitmap_num, duration), source in zip(frame_table, source_durations)]
+            profile['source_runtime_ms'] = sum(source_durations)
+            profile['max_duration_error_ms'] = max([abs(e) for e in errors] or [0])
+            profile['runtime_error_ms'] = sum(errors)
+        return profile
+    # Playback profiling end
+    
+
     # Main loaders and builders start
     def load_binary_data(self, header_data, frames_data):
         self.load_binary_animation_header(header_data)
@@ -352,21 +694,32 @@ class RunDmdAnimation(object):
         self.load_json_frames(json.dumps(data['frames']))
         self.load_json_animation_header(json.dumps(data['header']))
 
-    def build_binary_data(self, debug=False):
-        if debug == False:
-            self.animation_header_system_format()
-        header = self.build_binary_header()
-        frames = self.build_binary_frames()
-        return (header, frames)
+    def encode_binary_data(self, header=None):
+        '''Return (header_data, frames_data) as bytes without modifying the animation'''
+        frames_binary = self.encode_binary_frames()[0]
+        return (bytes(self.build_binary_animation_header(self.encode_binary_header(header))), frames_binary)
     
-    def build_json_data(self, debug=False):
-        if debug == False:
-            self.animation_header_user_format()
+    def encode_json_data(self, debug=False):
+        '''Return the animation as a JSON string (user format header unless debug) without modifying the animation'''
+        header = self.header if debug == True else self.encode_json_header()
         formatted_frames = []
         for i, frame in enumerate(self.frames):
             formatted_frames.append({'frame_num' : i, 'duration' : frame['duration'], 'bitmap' : frame['bitmap']})
-        out = {'header' : self.header, 'frames' : formatted_frames}
+        out = {'header' : header, 'frames' : formatted_frames}
         return json.dumps(out, indent=2)
+    
+    def build_binary_data(self, debug=False):
+        if debug == True:
+            return (self.build_binary_animation_header(), self.build_binary_frames())
+        header_data, frames_data = self.encode_binary_data()
+        return (bytearray(header_data), bytearray(frames_data))
+    
+    def build_json_data(self, debug=False):
+        return self.encode_json_data(debug)
+    
+    def open_json_stream(self, fname, progress=None):
+        '''Start writing the animation to a JSON file frame by frame, see RunDmdJsonStream'''
+        return RunDmdJsonStream(self, fname, progress)
     # Main loaders and builders end
     
 
@@ -387,228 +740,333 @@ class RunDmdAnimation(object):
                     logger.debug('  {}: {}'.format(key, frame[key]))
     
     def sanity_check_animation_header(self, binary_data):
-        # binary -> dic -> json -> dic -> binary
-        self.load_binary_animation_header(binary_data)
-        orig_dic = self.header.copy()
+        '''
+        binary -> dic -> json -> dic -> binary on a scratch animation.  Returns a list of mismatches, empty when the
+        round trip is exact
+        '''
+        mismatches = []
+        ani = RunDmdAnimation()
+        ani.load_binary_animation_header(binary_data)
+        orig_dic = ani.header.copy()
         
-        json_str = self.build_json_animation_header()
-        self.load_json_animation_header(json_str)
-        new_dic = self.header.copy()
+        json_str = ani.build_json_animation_header()
+        ani.load_json_animation_header(json_str)
+        new_dic = ani.header.copy()
         if new_dic != orig_dic:
             logger.debug('After JSON load, the header data no longer matches')
-            sys.exit(1)
+            mismatches.append({'stage' : 'json', 'fields' : sorted(key for key in orig_dic if orig_dic[key] != new_dic.get(key))})
         
-        new_binary_data = self.build_binary_animation_header()
+        new_binary_data = ani.build_binary_animation_header()
         if new_binary_data != binary_data:
             logger.debug('After binary dump, the header data no longer matches')
-            logger.debug('{}'.format(binary_data.hex()))
-            logger.debug('{}'.format(new_binary_data.hex()))
-            sys.exit(1)
+            offset, count = self._diff_bytes(binary_data, new_binary_data)
+            mismatches.append({'stage' : 'binary', 'offset' : offset, 'differing_bytes' : count})
+        return mismatches
     
     def sanity_check_frames(self, binary_data):
-        # binary -> dic -> json -> dic -> binary
-        self.load_binary_frames(binary_data)
-        orig_lst = self.frames.copy()
+        '''
+        binary -> list -> json -> list -> binary on a scratch animation using the total_frames of self.header.  Returns
+        a list of mismatches, empty when the round trip is exact
+        '''
+        mismatches = []
+        ani = RunDmdAnimation()
+        ani.header = dict(self.header)
+        ani.load_binary_frames(binary_data)
+        orig_lst = ani.frames.copy()
         
-        json_str = self.build_json_frames()
-        self.load_json_frames(json_str)
-        new_lst = self.frames.copy()
+        json_str = ani.build_json_frames()
+        ani.load_json_frames(json_str)
+        new_lst = ani.frames.copy()
         if new_lst != orig_lst:
             logger.debug('After JSON load, the frame data no longer matches')
-            sys.exit(1)
+            mismatches.append({'stage' : 'json', 'frames' : [i for i, frame in enumerate(orig_lst) if i >= len(new_lst) or new_lst[i] != frame]})
         
-        new_binary_data = self.build_binary_frames()
+        new_binary_data = ani.encode_binary_frames()[0]
         if new_binary_data != binary_data:
             logger.debug('After binary dump, the frame data no longer matches')
-            #logger.debug('{}'.format(binary_data.hex()[0:50]))
-            #logger.debug('{}'.format(new_binary_data.hex()[0:50]))
-            #sys.exit(1)
+            offset, count = self._diff_bytes(binary_data, new_binary_data)
+            mismatches.append({'stage' : 'binary', 'offset' : offset, 'differing_bytes' : count})
+        return mismatches
+    
+    def verify_round_trip(self, header_data, frames_data):
+        '''
+        Run one animation through binary -> JSON -> binary the way rip_image.py and create_image.py would.  The
+        fields the JSON files do not carry (name, global ID, flags, frame address) are taken from the original, as
+        finalize() would fill them in.  Hashes are compared first and only mismatches are diffed.  Returns a dict
+        with the header field mismatches, the user format header fields (clock fields as frame numbers) that changed
+        and, if the frame blob changed, where it differs and whether every frame still shows the same pixels for the
+        same duration.  Changes to num_bitmaps and the clock bitmap numbers only count as equivalent when the pixels,
+        durations and user format header all survived.  Offsets are relative to the header and frame blob
+        '''
+        orig = RunDmdAnimation()
+        orig.load_binary_data(header_data, frames_data)
+        rebuilt = RunDmdAnimation()
+        rebuilt.load_json_data(orig.encode_json_data())
+        for key in ['name', 'global_id', 'flags', 'frames_addr']:
+            rebuilt.header[key] = orig.header[key]
+        new_header_data, new_frames_data = rebuilt.encode_binary_data()
+        
+        header_data = bytes(header_data)
+        frames_data = bytes(frames_data)
+        report = {
+            'name' : orig.header['name'],
+            'header_sha1' : hashlib.sha1(header_data).hexdigest(),
+            'frames_sha1' : hashlib.sha1(frames_data).hexdigest(),
+            'header' : [],
+            'user_header' : [],
+            'frames' : None,
+            'status' : 'exact'
+        }
+        header_changed = hashlib.sha1(new_header_data).hexdigest() != report['header_sha1']
+        frames_changed = hashlib.sha1(new_frames_data).hexdigest() != report['frames_sha1']
+        if not (header_changed or frames_changed):
+            return report
+        decoded = RunDmdAnimation()
+        decoded.load_binary_data(new_header_data, new_frames_data)
+        
+        if header_changed:
+            offset = 0
+            for field, params in self.animation_header_format:
+                width = params['width']
+                if header_data[offset:offset+width] != new_header_data[offset:offset+width]:
+                    report['header'].append({'field' : field, 'offset' : offset, 'expected' : orig.header[field], 'actual' : decoded.header[field],
+                                             'storage' : field in self.bitmap_storage_keys})
+                offset += width
+            if header_data[offset:] != new_header_data[offset:]:
+                first, count = self._diff_bytes(header_data[offset:], new_header_data[offset:])
+                report['header'].append({'field' : 'padding', 'offset' : offset + first, 'expected' : header_data[offset:].hex(), 'actual' : new_header_data[offset:].hex(),
+                                         'storage' : False})
+            # Bitmap numbers may move when bitmaps are dropped or merged, what matters is the frame they point at
+            orig_user, new_user = orig.encode_json_header(), decoded.encode_json_header()
+            report['user_header'] = [{'field' : key, 'expected' : orig_user[key], 'actual' : new_user[key]} for key in self.user_header_keys if orig_user[key] != new_user[key]]
+        
+        if frames_changed:
+            first, count = self._diff_bytes(frames_data, new_frames_data)
+            table_size = min(len(orig.frames) * 2, self.block_size)
+            report['frames'] = {
+                'expected_size' : len(frames_data),
+                'actual_size' : len(new_frames_data),
+                'offset' : first,
+                'differing_bytes' : count,
+                'table_entries' : [i for i in range(0, table_size, 2) if frames_data[i:i+2] != new_frames_data[i:i+2]],
+                'bitmaps_equal' : [f['bitmap'] for f in orig.frames] == [f['bitmap'] for f in decoded.frames],
+                'durations_equal' : [f['duration'] for f in orig.frames] == [f['duration'] for f in decoded.frames]
+            }
+            report['frames']['table_entries'] = [i // 2 for i in report['frames']['table_entries']]
+        
+        if (any(not mismatch['storage'] for mismatch in report['header']) or len(report['user_header']) or
+            (report['frames'] != None and not (report['frames']['bitmaps_equal'] and report['frames']['durations_equal']))):
+            report['status'] = 'different'
+        else:
+            # Same pixels, timing and user header, only the bitmap storage changed (unreferenced or duplicate bitmaps dropped)
+            report['status'] = 'equivalent'
+        return report
     # Debug methods end
 
 
-class RunDmdImage(object):
-    known_image_issues = {
-        'B134' : [
-            'ATTACK_FROM_MARS_033', # Bitmap 16 and 17 are identical, header only references bitmap 16
-            'BIG_BANG_BAR_026', # Image problem?  0x00953000: 01320232033204320532066e0732083209320a320b320c32066e0e320f3210321132123213321432153216321732186919321a321b321c321d321e321f322032, 0x953018 should be 0x0d
-            'BLACK_ROSE_020', # Bitmap 2 and 3 are identical, header only references bitmap 2
-            'BRAM_STOKERS_DRACULA_023', # Bitmap 4 and 5 are identical, header only references bitmap 5
-            'CACTUS_CANYON_008', # Bitmap 3 and 4 are identical, header only references bitmap 4
-            'CACTUS_CANYON_020', # Bitmap 12 and 13 are identical, header only references bitmap 12
-            'CACTUS_CANYON_039', # Bitmap 12 and 13 are identical, header only references bitmap 12
-            'CIRQUS_VOLTAIRE_025', # Purposely removed?  Bitmap 1 has the clown facing partially sideways
-            'CONGO_029', # Purposely removed?  Bitmap 1 looks out of place compared to {2, 3, 4, ...}
-            'CORVETTE_009', # Image problem?  Bitmap 21 could have been included in the animation
-            'CREATURE_FROM_THE_BLACK_L_014', # Image problem?  Bitmap 18 could have been included in the animation
-            'CREATURE_FROM_THE_BLACK_L_016', # Image problem?  Bitmap 21 could have been included in the animation
-            'FISH_TALES_016', # Purposely removed?  Bitmap 4 looks out of place compared to {1, 2, 3}
-            'FISH_TALES_035', # Bitmap 16 and 17 are identical, header only references bitmap 16
-            'GHOSTBUSTERS_049', # Image problem?  Bitmap 2 could have been included in the animation
-            'HURRICANE_022', # Bitmap 10 and 11 are identical, header only references bitmap 10
-            'INDIANA_JONES_023', # Appears to be old data.  This is the mine cart succseeding scene, but bitmap 48 is crashing
-            'INDIANA_JONES_024', # Image problem?  Bitmap 15 could have been included in the animation
-            'JUDGE_DREDD_010', # Bitmap 5 and 6 are identical, header only references bitmap 5
-            'JUDGE_DREDD_021', # Purposely removed?  Bitmap 44 looks out of place compared to the final animation bitmaps
-            'JUDGE_DREDD_033', # Image problem?  Bitmap 7 could have been included in the animation
-            'JUDGE_DREDD_047', # Bitmap 5 and 6 are identical, header only references bitmap 5
-            'METALLICA_009', # Bitmap 18 and 19 are identical, header only references bitmap 19
-            'MONSTER_BASH_042', # Image problem?  Bitmap 61 could have been included in the animation
-            'MUSTANG_022', # Purposely removed?  Bitmap 19 is mostly transparency
-            'NO_GOOD_GOFERS_009', # Purposely removed?  Bitmap 5 looks out of place compared to {1, 2, 3, 4}
-            'NO_GOOD_GOFERS_050', # Image problem?  Bitmap 7 could have been included in the animation
-            'PIRATES_OF_THE_CARIBBEAN_034', # Image problem?  Bitmap 20 could have been included in the animation
-            'STAR_TREK_020', # Purposely removed?  Bitmap 37 looks out of place compared to rest of animation
-            'STAR_TREK_THE_NEXT_GEN_017', # Image problem?  Bitmap 5 could have been included in the animation
-            'THE_CHAMPION_PUB_007', # Bitmap 12 and 13 are identical, header only references bitmap 12
-            'THE_CHAMPION_PUB_010', # Image problem?  Bitmap 1 could have been included in the animation
-            'THE_CHAMPION_PUB_025', # Image problem?  Bitmap 6 could have been included in the animation
-            'THE_CHAMPION_PUB_046', # Image problem?  Bitmap 3 could have been included in the animation
-            'THE_CHAMPION_PUB_064', # Bitmap 60 and 61 are identical, header only references bitmap 60
-            'THE_SHADOW_037', # Image problem?  Bitmap 9 could have been included in the animation
-            'THE_WALKING_DEAD_013', # Purposely removed?  Bitmap 75 looks out of place compared to the final animation bitmaps
-            'WHO_DUNNIT_012', # Purposely removed?  Bitmap 7 is axe being pulled back
-            'WHO_DUNNIT_018', # Image problem?  Bitmap 11 could have been included in the animation
-            'WORLD_CUP_SOCCER_017', # Bitmap 5 and 6 are identical, header only references bitmap 5
-            'WORLD_CUP_SOCCER_033', # Bitmap 52 and 53 are identical, header only references bitmap 52
-            'X-MEN_054', # Image problem?  Bitmap 33 could have been included in the animation
-        ],
-        'B237' : [
-            'ATTACK_FROM_MARS_033', # Bitmap 16 and 17 are identical, header only references bitmap 16
-            'BIG_BANG_BAR_026', # Image problem?  0x00953000: 01320232033204320532066e0732083209320a320b320c32066e0e320f3210321132123213321432153216321732186919321a321b321c321d321e321f322032, 0x953018 should be 0x0d
-            'BLACK_ROSE_020', # Bitmap 2 and 3 are identical, header only references bitmap 2
-            'BRAM_STOKERS_DRACULA_023', # Bitmap 4 and 5 are identical, header only references bitmap 5
-            'CACTUS_CANYON_008', # Bitmap 3 and 4 are identical, header only references bitmap 4
-            'CACTUS_CANYON_020', # Bitmap 12 and 13 are identical, header only references bitmap 12
-            'CACTUS_CANYON_039', # Bitmap 12 and 13 are identical, header only references bitmap 12
-            'CIRQUS_VOLTAIRE_025', # Purposely removed?  Bitmap 1 has the clown facing partially sideways
-            'CONGO_029', # Purposely removed?  Bitmap 1 looks out of place compared to {2, 3, 4, ...}
-            'CORVETTE_009', # Image problem?  Bitmap 21 could have been included in the animation
-            'CREATURE_FROM_THE_BLACK_L_014', # Image problem?  Bitmap 18 could have been included in the animation
-            'CREATURE_FROM_THE_BLACK_L_016', # Image problem?  Bitmap 21 could have been included in the animation
-            'FISH_TALES_016', # Purposely removed?  Bitmap 4 looks out of place compared to {1, 2, 3}
-            'FISH_TALES_035', # Bitmap 16 and 17 are identical, header only references bitmap 16
-            'GHOSTBUSTERS_049', # Image problem?  Bitmap 2 could have been included in the animation
-            'HURRICANE_022', # Bitmap 10 and 11 are identical, header only references bitmap 10
-            'INDIANA_JONES_023', # Appears to be old data.  This is the mine cart succseeding scene, but bitmap 48 is crashing
-            'INDIANA_JONES_024', # Image problem?  Bitmap 15 could have been included in the animation
-            'JUDGE_DREDD_010', # Bitmap 5 and 6 are identical, header only references bitmap 5
-            'JUDGE_DREDD_021', # Purposely removed?  Bitmap 44 looks out of place compared to the final animation bitmaps
-            'JUDGE_DREDD_033', # Image problem?  Bitmap 7 could have been included in the animation
-            'JUDGE_DREDD_047', # Bitmap 5 and 6 are identical, header only references bitmap 5
-            'LAST_ACTION_HERO_043', # Bitmap 1 and 19 are the same, with the exception that 19 has been edited to add transparency.  Looks like the header was changed to always use bitmap 19
-            'METALLICA_009', # Bitmap 18 and 19 are identical, header only references bitmap 19
-            'MONSTER_BASH_042', # Image problem?  Bitmap 61 could have been included in the animation
-            'MUSTANG_022', # Purposely removed?  Bitmap 19 is mostly transparency
-            'NO_GOOD_GOFERS_009', # Purposely removed?  Bitmap 5 looks out of place compared to {1, 2, 3, 4}
-            'NO_GOOD_GOFERS_050', # Image problem?  Bitmap 7 could have been included in the animation
-            'PIRATES_OF_THE_CARIBBEAN_034', # Image problem?  Bitmap 20 could have been included in the animation
-            'STAR_TREK_020', # Purposely removed?  Bitmap 37 looks out of place compared to rest of animation
-            'STAR_TREK_THE_NEXT_GEN_017', # Image problem?  Bitmap 5 could have been included in the animation
-            'THE_CHAMPION_PUB_007', # Bitmap 12 and 13 are identical, header only references bitmap 12
-            'THE_CHAMPION_PUB_010', # Image problem?  Bitmap 1 could have been included in the animation
-            'THE_CHAMPION_PUB_025', # Image problem?  Bitmap 6 could have been included in the animation
-            'THE_CHAMPION_PUB_046', # Image problem?  Bitmap 3 could have been included in the animation
-            'THE_CHAMPION_PUB_064', # Bitmap 60 and 61 are identical, header only references bitmap 60
-            'THE_SHADOW_037', # Image problem?  Bitmap 9 could have been included in the animation
-            'THE_WALKING_DEAD_013', # Purposely removed?  Bitmap 75 looks out of place compared to the final animation bitmaps
-            'WHO_DUNNIT_012', # Purposely removed?  Bitmap 7 is axe being pulled back
-            'WHO_DUNNIT_018', # Image problem?  Bitmap 11 could have been included in the animation
-            'WORLD_CUP_SOCCER_017', # Bitmap 5 and 6 are identical, header only references bitmap 5
-            'WORLD_CUP_SOCCER_033', # Bitmap 52 and 53 are identical, header only references bitmap 52
-            'X-MEN_054', # Image problem?  Bitmap 33 could have been included in the animation
-        ]
-    }
+class RunDmdJsonStream(object):
+    '''
+    Writes an animation JSON file (byte for byte what RunDmdAnimation.build_json_data would write) while the frames are
+    being produced, so converters never hold the whole animation in memory.  The frames go to a temporary file next to
+    the output, and close() writes the header, once the frame count (and so the default clock end frame) is known,
+    followed by the frames.  The frames are not added to ani.frames
+    '''
+    def __init__(self, ani, fname, progress=None):
+        self.ani = ani
+        self.fname = fname
+        self.progress = progress
+        self.frame_count = 0
+        self.frames_fname = fname + '.{}.tmp'.format(os.getpid())
+        self.fh = open(self.frames_fname, 'w')
+    
+    def _header_text(self):
+        header = self.ani.encode_json_header(total_frames=self.frame_count)
+        return json.dumps(header, indent=2).replace('\n', '\n  ')
+    
+    def write_frame(self, duration, bitmap):
+        frame = {'frame_num' : self.frame_count, 'duration' : duration, 'bitmap' : bitmap}
+        self.fh.write(',\n' if self.frame_count else '\n')
+        self.fh.write('    ' + json.dumps(frame, indent=2).replace('\n', '\n    '))
+        self.frame_count += 1
+        if self.progress != None:
+            self.progress(self.frame_count)
+    
+    def write_bitmaps(self, bitmaps, durations):
+        '''Write a (N, 32, 128) nibble array (see RunDmdBitmap) as N frames'''
+        import RunDmdBitmap
+        for bitmap, duration in zip(bitmaps, durations):
+            self.write_frame(duration, RunDmdBitmap.array_to_rows(bitmap))
+    
+    def close(self):
+        if self.fh == None:
+            return
+        self.fh.write('\n  ]\n}' if self.frame_count else ']\n}')
+        self.fh.close()
+        self.fh = None
+        try:
+            with open(self.fname, 'w') as out, open(self.frames_fname, 'r') as frames:
+                out.write('{\n  "header": ' + self._header_text() + ',\n  "frames": [')
+                shutil.copyfileobj(frames, out)
+        finally:
+            self._remove(self.frames_fname)
+        if self.progress != None:
+            self.progress(self.frame_count, done=True)
+    
+    def abort(self):
+        '''Drop the frames written so far without touching the output file'''
+        if self.fh == None:
+            return
+        self.fh.close()
+        self.fh = None
+        self._remove(self.frames_fname)
+    
+    @staticmethod
+    def _remove(fname):
+        if os.path.exists(fname):
+            os.remove(fname)
+    
+    def __enter__(self):
+        return self
     
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type != None:
+            self.abort()
+        else:
+            self.close()
+
+
+class RunDmdProgress(object):
+    '''Progress callback for long running loops, prints "<label>: <count>" at most once every interval seconds'''
+    def __init__(self, label, interval=1.0, stream=sys.stderr):
+        self.label = label
+        self.interval = interval
+        self.stream = stream
+        self.last_time = time.monotonic()
+    
+    def __call__(self, count, done=False):
+        now = time.monotonic()
+        if done or now - self.last_time >= self.interval:
+            self.last_time = now
+            self.stream.write('{}: {}{}\n'.format(self.label, count, ' (done)' if done else ''))
+            self.stream.flush()
+
+
+class RunDmdImage(object):
     ani_header_to_frame_data_padding = 51200
     
     def __init__(self):
         self.header = RunDmdHeader()
         self.animations = {}
+        self.image_size = 0
+        self.load_issues = []
+        self.frames_cache = {}
         return
     
-    def load_full_binary(self, fname):
-        offset = 0
+    def load_full_binary(self, fname, name_filter=None, headers_only=False):
+        '''
+        Load the main header and animations from a binary image.  If name_filter is given (see
+        RunDmdNameFilter), only the animations it selects are decoded, and only their frame regions
+        are read from disk.  With headers_only, only the main header and the animation header table
+        are read and the animations are left without frames
+        '''
+        for name, ani in self.iter_full_binary(fname, name_filter=name_filter, headers_only=headers_only):
+            if name not in self.animations:
+                self.animations[name] = []
+            self.animations[name].append(ani)
+    
+    def iter_full_binary(self, fname, name_filter=None, headers_only=False):
+        '''
+        Generator version of load_full_binary.  Yields (title, ani) for one fully decoded animation at a
+        time, in image order, without keeping it in self.animations.  The main header is loaded before the
+        first animation is yielded
+        '''
         with open(fname, 'rb') as fh:
-            # Main header
-            fh.seek(0)
-            segment_size = RunDmdHeader.block_size + RunDmdHeader.startup_pic_size
-            data = fh.read(segment_size)
-            self.header.load_binary_data(data)
-            offset += segment_size
-            
-            # Animations
-            for i in range(self.header.header['total_animations']):
-                ani = RunDmdAnimation()
+            for offset, header_data, ani in self.read_binary_headers(fh):
+                if name_filter != None and not name_filter(ani.header['name']):
+                    continue
                 
-                # Animation header
-                header_segment_size = ani.block_size
-                fh.seek(offset)
-                header_data = fh.read(header_segment_size)
-                ani.load_binary_animation_header(header_data)
-                offset += header_segment_size
-                
-                #if ani.header['name'] == 'AC#DC_012':
-                #    sys.exit(1)
+                if headers_only:
+                    yield (RunDmdTitleName(ani.header['name']), ani)
+                    continue
                 
                 # Animation frames
-                frames_offset = ani.header['frames_addr']
-                frames_segment_size = ani.header['num_bitmaps'] * ani.bitmap_size + ani.block_size
-                fh.seek(frames_offset)
-                frame_data = fh.read(frames_segment_size)
-                if ani.load_binary_frames(frame_data) != True and ani.header['name'] not in self.known_image_issues[self.header.header['version']]:
-                #if ani.load_binary_frames(frame_data) !=True or ani.header['name'] == 'AC#DC_011':
-                    logger.error('Load unsuccessful')
-                    
-                    logger.debug('Raw header data: ')
-                    data_bytes = header_data
-                    row_bytes = 64
-                    img_addr = offset - header_segment_size
-                    for j in range(0, len(data_bytes), row_bytes):
-                        hex_data = data_bytes[j:j+row_bytes].hex()
-                        logger.debug('  0x{:08x}: {}'.format(img_addr + j, hex_data))
-                    
-                    logger.debug('Raw frame indirection data: ')
-                    data_bytes = frame_data[:ani.block_size]
-                    row_bytes = 64
-                    img_addr = frames_offset
-                    for j in range(0, len(data_bytes), row_bytes):
-                        hex_data = data_bytes[j:j+row_bytes].hex()
-                        logger.debug('  0x{:08x}: {}'.format(img_addr + j, hex_data))
-                    
-                    logger.debug('Raw frames data: ')
-                    data_bytes = frame_data[ani.block_size:]
-                    row_bytes = 64
-                    img_addr = frames_offset + ani.block_size
-                    bitmap_num = 0
-                    for j in range(0, len(data_bytes), row_bytes):
-                        if ((j // row_bytes) % 32) == 0:
-                            frame_hash = hash(data_bytes[bitmap_num * 0x800 : bitmap_num * 0x800 + 0x800]) & 0xffffffff
-                            logger.debug('  Bitmap {} (0x{:08x})'.format(bitmap_num + 1, frame_hash))
-                            bitmap_num += 1
-                        hex_data = data_bytes[j:j+row_bytes].hex()
-                        logger.debug('  0x{:08x}: {}'.format(img_addr + j, hex_data))
-                        if ((j // row_bytes) % 32) + 1 == 32:
-                            logger.debug('  ')
-                    
-                    sys.exit(1)
+                frame_data = self.read_binary_frames(fh, ani)
+                if ani.load_binary_frames(frame_data) != True:
+                    # Known to happen in stock images (duplicate bitmaps where only one copy is referenced,
+                    # leftover bitmaps, ...), so report it and carry on
+                    issue = ani.analyze_binary_frames(frame_data)
+                    issue['header_offset'] = offset
+                    issue['frames_offset'] = ani.header['frames_addr']
+                    logger.warning('{}: unreferenced bitmaps {}, identical bitmaps {}'.format(issue['name'], issue['unreferenced'], issue['identical']))
+                    self.load_issues.append(issue)
                 
-                # Add it
-                full_name = ani.header['name']
-                name = full_name[:full_name.rfind('_')]
-                if name not in self.animations:
-                    self.animations[name] = []
-                self.animations[name].append(ani)
+                yield (RunDmdTitleName(ani.header['name']), ani)
+    
+    def read_binary_headers(self, fh):
+        '''
+        Read the main header and the animation header table from an open image.  Returns a list of
+        (header_offset, header_data, ani) tuples where only the animation header has been loaded
+        '''
+        # Main header
+        fh.seek(0)
+        segment_size = RunDmdHeader.block_size + RunDmdHeader.startup_pic_size
+        data = fh.read(segment_size)
+        self.header.load_binary_data(data)
+        
+        # Animation header table, read in one go
+        header_segment_size = RunDmdAnimation.block_size
+        header_table = fh.read(self.header.header['total_animations'] * header_segment_size)
+        
+        headers = []
+        for i in range(self.header.header['total_animations']):
+            ani = RunDmdAnimation()
+            header_data = header_table[i*header_segment_size:(i+1)*header_segment_size]
+            ani.load_binary_animation_header(header_data)
+            headers.append((segment_size + i * header_segment_size, header_data, ani))
+        return headers
+    
+    def read_binary_frames(self, fh, ani):
+        frames_segment_size = ani.header['num_bitmaps'] * ani.bitmap_size + ani.block_size
+        fh.seek(ani.header['frames_addr'])
+        return fh.read(frames_segment_size)
+    
+    def write_binary_animation(self, fname, header_offset, old_header, ani):
+        '''
+        Replace one animation inside an existing image.  The new frames are written over the old frame
+        region when they fit, otherwise they are appended to the end of the image.  Only the animation
+        header and frames are touched, the user editable header fields and frames come from ani
+        '''
+        frames_binary = ani.encode_binary_frames()[0]
+        new_header = ani.encode_binary_header()
+        header = dict(old_header)
+        for key in ani.user_header_keys + ['total_frames', 'num_bitmaps']:
+            header[key] = new_header[key]
+        
+        with open(fname, 'r+b') as fh:
+            if header['num_bitmaps'] > old_header['num_bitmaps']:
+                fh.seek(0, os.SEEK_END)
+                end = fh.tell()
+                header['frames_addr'] = (end + ani.block_size - 1) // ani.block_size * ani.block_size
+                logger.info('{} grew from {} to {} bitmaps, moving frames to 0x{:x}'.format(header['name'], old_header['num_bitmaps'], header['num_bitmaps'], header['frames_addr']))
+            # Build the header before writing anything, a field that does not fit raises here with the image untouched
+            new_ani = RunDmdAnimation()
+            new_ani.header = header
+            header_data = new_ani.build_binary_animation_header()
+            fh.seek(header['frames_addr'])
+            fh.write(frames_binary)
+            fh.seek(header_offset)
+            fh.write(header_data)
+        return header
     
-    def load_json_header_data(self, json_data):
-        self.header.load_json_data(json_data)
+    def load_json_header_data(self, json_data, base_dir=None):
+        self.header.load_json_data(json_data, base_dir)
     
     def load_json_animation_data(self, json_data, name=None):
         ani = RunDmdAnimation()
         ani.load_json_data(json_data)
         if name != None:
             ani.header['name'] = name        
-        full_name = ani.header['name']
-        name = full_name[:full_name.rfind('_')]
+        name = RunDmdTitleName(ani.header['name'])
         if name not in self.animations:
             self.animations[name] = []
         self.animations[name].append(ani)
@@ -625,66 +1083,302 @@ class RunDmdImage(object):
             global_id
             enable flag (optional)
         '''
-        ani_count = 0
-        for title in self.animations:
-            ani_count += len(self.animations[title])
+        animations = [ani for title in sorted(self.animations) for ani in self.animations[title]]
+        if enable_all == True:
+            for ani in animations:
+                ani.header['flags'] += ' | Enable'
+        frames_sizes = [len(ani.encode_binary_frames()[0]) for ani in animations]
+        placements, enabled_field, end = self._plan_layout(frames_sizes, ['Enable' in ani.header['flags'] for ani in animations])
         
-        cur_offset = self.header.block_size + self.header.startup_pic_size
-        cur_offset += ani_count * RunDmdAnimation.block_size
-        cur_offset += self.ani_header_to_frame_data_padding
-        
-        enable_count = 1 # For some reason, the enable count is +1
-        global_id = 1
+        for global_id, (ani, frames_size, (header_offset, frames_addr)) in enumerate(zip(animations, frames_sizes, placements), start=1):
+            ani.header['global_id'] = global_id
+            ani.header['total_frames'] = len(ani.frames)
+            ani.header['frames_addr'] = frames_addr
+            ani.header['num_bitmaps'] = (frames_size - ani.block_size) // ani.bitmap_size
+        self.image_size = end
+        self.header.header['total_animations'] = len(animations)
+        self.header.header['enabled_animations'] = enabled_field
+        self.header.header['version'] = 'X001'
+    
+    def _plan_layout(self, frames_sizes, enabled):
+        '''
+        Lay out an image holding animations with the given frame blob sizes and Enable flags, in image order.  The
+        animation header table follows the main header and startup picture, and the frame blobs follow the table after
+        ani_header_to_frame_data_padding.  Returns (placements, enabled_field, end): the (header_offset, frames_addr)
+        of every animation, the main header enabled_animations value and the end of the frame data
+        '''
+        header_offset = self.header.block_size + self.header.startup_pic_size
+        cur_offset = header_offset + len(frames_sizes) * RunDmdAnimation.block_size + self.ani_header_to_frame_data_padding
+        placements = []
+        for frames_size in frames_sizes:
+            placements.append((header_offset, cur_offset))
+            header_offset += RunDmdAnimation.block_size
+            cur_offset += frames_size
+        return (placements, self.enabled_field(sum(1 for e in enabled if e)), cur_offset)
+    
+    # For some reason, the enable count is +1
+    @staticmethod
+    def enabled_field(enable_count):
+        '''Main header enabled_animations value for enable_count enabled animations'''
+        return enable_count + 1
+    
+    @staticmethod
+    def enable_count(enabled_field):
+        '''Number of enabled animations for a main header enabled_animations value'''
+        return enabled_field - 1
+    
+    def write_full_binary(self, fname, min_size=0, workers=None, fsync='none'):
+        '''
+        Write the image laid out by finalize().  The file is preallocated to its final size (anything not
+        written, like the padding, stays a sparse hole) and the animation headers and frame blobs are
+        written by a pool of threads at the offsets that finalize() assigned.  fsync can be 'none', 'end'
+        (once after everything is written) or 'each' (after every animation)
+        '''
+        header_offset = self.header.block_size + self.header.startup_pic_size
+        jobs = []
         for title in sorted(self.animations):
             for ani in self.animations[title]:
-                frames_binary = ani.build_binary_frames()
-                ani.header['global_id'] = global_id
-                ani.header['total_frames'] = len(ani.frames)
-                ani.header['frames_addr'] = cur_offset
-                ani.header['num_bitmaps'] = (len(frames_binary) - ani.block_size) // ani.bitmap_size
-                if enable_all == True:
-                    ani.header['flags'] += ' | Enable'
-                    enable_count += 1
-                else:
-                    if 'Enable' in ani.header['flags']:
-                        enable_count += 1
-                
-                cur_offset += len(frames_binary)
-                global_id += 1
-        self.header.header['total_animations'] = ani_count
-        self.header.header['enabled_animations'] = enable_count
-        self.header.header['version'] = 'X001'
+                jobs.append((header_offset, ani.header['frames_addr'], lambda a=ani: a.encode_binary_data()[0], lambda a=ani: a.encode_binary_frames()[0]))
+                header_offset += ani.block_size
+        self._write_image(fname, self.header.build_binary_data(), jobs, max(self.image_size, min_size), workers, fsync)
     
-    def write_full_binary(self, fname, min_size=0):
-        with open(fname, 'wb') as fh:
-            # Main header
-            data = self.header.build_binary_data()
-            logger.info('writing main header of size 0x{:x}'.format(len(data)))
-            fh.write(self.header.build_binary_data())
+    def _write_image(self, fname, main_header_data, jobs, total_size, workers, fsync):
+        # jobs are (header_offset, frames_addr, header builder, frames builder), the builders run in the worker threads
+        fd = os.open(fname, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            os.ftruncate(fd, total_size)
+            
+            if hasattr(os, 'pwrite'):
+                def write_at(data, offset):
+                    while len(data):
+                        written = os.pwrite(fd, data, offset)
+                        data = data[written:]
+                        offset += written
+            else:
+                write_lock = threading.Lock()
+                def write_at(data, offset):
+                    with write_lock:
+                        os.lseek(fd, offset, os.SEEK_SET)
+                        while len(data):
+                            data = data[os.write(fd, data):]
             
-            # Animation headers
-            for title in sorted(self.animations):
-                for ani in self.animations[title]:
-                    fh.write(ani.build_binary_animation_header())
+            def write_animation(job):
+                header_offset, frames_addr, build_header, build_frames = job
+                write_at(memoryview(build_header()), header_offset)
+                write_at(memoryview(build_frames()), frames_addr)
+                if fsync == 'each':
+                    os.fsync(fd)
             
-            # Padding
-            fh.write(bytearray(self.ani_header_to_frame_data_padding))
+            # Main header
+            logger.info('writing main header of size 0x{:x}'.format(len(main_header_data)))
+            write_at(memoryview(main_header_data), 0)
             
-            # Animation bitmaps
-            for title in sorted(self.animations):
-                for ani in self.animations[title]:
-                    fh.write(ani.build_binary_frames())
+            # Animation headers and bitmaps
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for _ in executor.map(write_animation, jobs):
+                    pass
             
-            # Padding
-            cur_size = fh.tell()
-            if cur_size < min_size:
-                fh.write(bytearray(min_size - cur_size))
+            if fsync != 'none':
+                os.fsync(fd)
+        finally:
+            os.close(fd)
     
-    def get_header(self):
-        return self.header.build_json_data()
+    def apply_enable_profile(self, fname, enable_filter, dry_run=False):
+        '''
+        Set the Enable flag of every animation in an existing image to enable_filter(ani), where ani only
+        has its header loaded.  Only the flag bytes that change and the main header enable count (see
+        enabled_field) are rewritten.  Returns the list of (name, enabled) changes
+        '''
+        enable_bit = 1 << RunDmdAnimation.flags['Enable']
+        flags_offset = RunDmdFieldOffset(RunDmdAnimation.animation_header_format, 'flags')
+        count_offset = RunDmdFieldOffset(RunDmdHeader.main_header_format, 'enabled_animations')
+        count_width = dict(RunDmdHeader.main_header_format)['enabled_animations']['width']
+        
+        with open(fname, 'rb' if dry_run else 'r+b') as fh:
+            headers = self.read_binary_headers(fh)
+            changes = []
+            enable_count = 0
+            for offset, header_data, ani in headers:
+                enabled = bool(enable_filter(ani))
+                if enabled:
+                    enable_count += 1
+                flags_byte = header_data[flags_offset]
+                new_flags_byte = (flags_byte | enable_bit) if enabled else (flags_byte & ~enable_bit)
+                if new_flags_byte == flags_byte:
+                    continue
+                changes.append((ani.header['name'], enabled))
+                if not dry_run:
+                    fh.seek(offset + flags_offset)
+                    fh.write(bytes([new_flags_byte]))
+            
+            enabled_field = self.enabled_field(enable_count)
+            if not dry_run and enabled_field != self.header.header['enabled_animations']:
+                fh.seek(count_offset)
+                fh.write(enabled_field.to_bytes(count_width, 'big'))
+            self.header.header['enabled_animations'] = enabled_field
+        return changes
+    
+    # Variant builds start
+    def encode_frames(self, workers=None):
+        '''
+        Encode the frames of every loaded animation once.  The (frames_binary, frame_to_bitmap) results are kept in
+        self.frames_cache and shared by every write_variant() call
+        '''
+        animations = [ani for title in sorted(self.animations) for ani in self.animations[title] if id(ani) not in self.frames_cache]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for ani, encoded in zip(animations, executor.map(lambda a: a.encode_binary_frames(), animations)):
+                self.frames_cache[id(ani)] = encoded
+    
+    def select_variant(self, name_filter=None, title_order=None):
+        '''
+        Pick the animations for a variant image.  title_order is a list of glob patterns, titles are placed
+        by the first pattern they match (titles matching none go last) and alphabetically within a pattern
+        '''
+        def title_rank(title):
+            for i, pattern in enumerate(title_order or []):
+                if fnmatch.fnmatchcase(title, pattern):
+                    return (i, title)
+            return (len(title_order or []), title)
+        
+        selected = []
+        for title in sorted(self.animations, key=title_rank):
+            for ani in self.animations[title]:
+                if name_filter == None or name_filter(ani.header['name']):
+                    selected.append(ani)
+        return selected
+    
+    def write_variant(self, fname, animations, enable_filter=None, min_size=0, workers=None, fsync='none'):
+        '''
+        Lay out and write an image holding the given animations in the given order, the same way finalize()
+        and write_full_binary() would, but without modifying the animations or the loaded main header.
+        enable_filter decides each animation's Enable flag, None keeps the flag it was loaded with
+        '''
+        self.encode_frames(workers)
+        
+        enabled = [enable_filter(ani.header['name']) if enable_filter != None else 'Enable' in ani.header['flags'] for ani in animations]
+        placements, enabled_field, end = self._plan_layout([len(self.frames_cache[id(ani)][0]) for ani in animations], enabled)
+        jobs = []
+        for global_id, (ani, ani_enabled, (header_offset, frames_addr)) in enumerate(zip(animations, enabled, placements), start=1):
+            encoded = self.frames_cache[id(ani)]
+            header = ani.encode_binary_header(encoded=encoded)
+            header['global_id'] = global_id
+            header['frames_addr'] = frames_addr
+            flags = [f.strip() for f in header['flags'].split('|') if f.strip() not in ('', 'Enable')]
+            if ani_enabled:
+                flags.append('Enable')
+            header['flags'] = ' | '.join(flags)
+            jobs.append((header_offset, frames_addr, lambda a=ani, h=header: a.build_binary_animation_header(h), lambda b=encoded[0]: b))
+        
+        main_header = RunDmdHeader()
+        main_header.header = dict(self.header.header)
+        main_header.header['total_animations'] = len(animations)
+        main_header.header['enabled_animations'] = enabled_field
+        main_header.header['version'] = 'X001'
+        self._write_image(fname, main_header.build_binary_data(), jobs, max(end, min_size), workers, fsync)
+        return (len(animations), sum(1 for e in enabled if e), end)
+    # Variant builds end
+
+    # Binary merge start
+    def merge_binary(self, fname, parts, min_size=0, workers=None, fsync='none'):
+        '''
+        Write an image made of animations copied from other images.  parts is a list of (image fname, name_filter) in
+        output order, a name_filter of None takes every animation of that image.  The animation headers are copied
+        verbatim except for global_id and frames_addr, and the frame blobs are copied byte for byte without decoding
+        any bitmaps.  The main header is self.header (load it with read_binary_headers first) with the animation
+        counts rewritten.  Returns (count, enabled, used_size)
+        '''
+        selected = []
+        for src_fname, name_filter in parts:
+            with open(src_fname, 'rb') as fh:
+                for offset, header_data, ani in RunDmdImage().read_binary_headers(fh):
+                    if name_filter == None or name_filter(ani.header['name']):
+                        selected.append((src_fname, header_data, ani))
+
+        header_fields = dict(RunDmdAnimation.animation_header_format)
+        id_offset = RunDmdFieldOffset(RunDmdAnimation.animation_header_format, 'global_id')
+        id_width = header_fields['global_id']['width']
+        addr_offset = RunDmdFieldOffset(RunDmdAnimation.animation_header_format, 'frames_addr')
+        addr_width = header_fields['frames_addr']['width']
+
+        def read_frames(src_fname, frames_addr, size):
+            with open(src_fname, 'rb') as fh:
+                fh.seek(frames_addr)
+                data = fh.read(size)
+            if len(data) != size:
+                logger.warning('{} is truncated at 0x{:x}, padding the frames with zeros'.format(src_fname, frames_addr + len(data)))
+                data += bytes(size - len(data))
+            return data
+
+        enabled = ['Enable' in ani.header['flags'] for src_fname, header_data, ani in selected]
+        frames_sizes = [ani.header['num_bitmaps'] * ani.bitmap_size + ani.block_size for src_fname, header_data, ani in selected]
+        placements, enabled_field, end = self._plan_layout(frames_sizes, enabled)
+        names = set()
+        jobs = []
+        for global_id, ((src_fname, header_data, ani), frames_size, (header_offset, frames_addr)) in enumerate(zip(selected, frames_sizes, placements), start=1):
+            if ani.header['name'] in names:
+                logger.warning('{} is included more than once'.format(ani.header['name']))
+            names.add(ani.header['name'])
+
+            header = bytearray(header_data)
+            header[id_offset:id_offset+id_width] = global_id.to_bytes(id_width, 'big')
+            header[addr_offset:addr_offset+addr_width] = (frames_addr // RunDmdAnimation.block_size).to_bytes(addr_width, 'big')
+            jobs.append((header_offset, frames_addr, lambda h=bytes(header): h,
+                         lambda s=src_fname, a=ani.header['frames_addr'], n=frames_size: read_frames(s, a, n)))
+
+        main_header = RunDmdHeader()
+        main_header.header = dict(self.header.header)
+        main_header.header['total_animations'] = len(selected)
+        main_header.header['enabled_animations'] = enabled_field
+        self._write_image(fname, main_header.build_binary_data(), jobs, max(end, min_size), workers, fsync)
+        return (len(selected), sum(1 for e in enabled if e), end)
+    # Binary merge end
+    
+    def get_header(self, startup_picture_file='startup_picture.bin'):
+        return self.header.build_json_data(startup_picture_file)
+    
+    def get_startup_picture(self, fmt='bin'):
+        return self.header.build_startup_picture(fmt)
     
     def get_animations(self):
         for key in sorted(self.animations):
             for ani in self.animations[key]:
                 yield (key, ani.build_json_data())
+    
+    # Debug methods start
+    def debug_dump_binary_animation(self, header_offset, header_data, frame_data):
+        ani = RunDmdAnimation()
+        ani.load_binary_animation_header(header_data)
+        frames_offset = ani.header['frames_addr']
+        
+        logger.debug('Raw header data: ')
+        data_bytes = header_data
+        row_bytes = 64
+        img_addr = header_offset
+        for j in range(0, len(data_bytes), row_bytes):
+            hex_data = data_bytes[j:j+row_bytes].hex()
+            logger.debug('  0x{:08x}: {}'.format(img_addr + j, hex_data))
+        
+        logger.debug('Raw frame indirection data: ')
+        data_bytes = frame_data[:ani.block_size]
+        row_bytes = 64
+        img_addr = frames_offset
+        for j in range(0, len(data_bytes), row_bytes):
+            hex_data = data_bytes[j:j+row_bytes].hex()
+            logger.debug('  0x{:08x}: {}'.format(img_addr + j, hex_data))
+        
+        logger.debug('Raw frames data: ')
+        data_bytes = frame_data[ani.block_size:]
+        row_bytes = 64
+        img_addr = frames_offset + ani.block_size
+        bitmap_num = 0
+        for j in range(0, len(data_bytes), row_bytes):
+            if ((j // row_bytes) % 32) == 0:
+                frame_hash = hash(data_bytes[bitmap_num * 0x800 : bitmap_num * 0x800 + 0x800]) & 0xffffffff
+                logger.debug('  Bitmap {} (0x{:08x})'.format(bitmap_num + 1, frame_hash))
+                bitmap_num += 1
+            hex_data = data_bytes[j:j+row_bytes].hex()
+            logger.debug('  0x{:08x}: {}'.format(img_addr + j, hex_data))
+            if ((j // row_bytes) % 32) + 1 == 32:
+                logger.debug('  ')
+    # Debug methods end
 
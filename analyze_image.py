@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import argparse
+import json
+import logging
+import numpy as np
+import RunDmdImage
+import RunDmdBitmap
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Report identical, near-identical and unreferenced bitmaps in a RunDMD binary image')
+    parser.add_argument('--image', help='RunDMD raw binary image path', type=argparse.FileType('r'), required=True)
+    parser.add_argument('--threshold', help='Bitmaps differing in at most this many pixels are reported as near-identical (0 disables)', type=int, default=32)
+    parser.add_argument('--report', help='Write the full report to this JSON file', type=argparse.FileType('w'))
+    parser.add_argument('--dump', help='Hex dump the raw data of animations with problems', action='store_true', default=False)
+    parser.add_argument('--include', help='Only analyze animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--exclude', help='Skip animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--regex', help='Treat --include/--exclude patterns as regular expressions instead of globs', action='store_true', default=False)
+    return parser.parse_args()
+
+def near_identical(frame_data, num_bitmaps, threshold):
+    '''Return [bitmap a, bitmap b, differing pixels] (1-based) for every pair of distinct bitmaps within the threshold'''
+    if num_bitmaps < 2:
+        return []
+    bitmaps = RunDmdBitmap.bytes_to_array(frame_data[RunDmdImage.RunDmdAnimation.block_size:])[:num_bitmaps]
+    diffs = RunDmdBitmap.pixel_differences(bitmaps)
+    pairs = np.argwhere(np.triu((diffs > 0) & (diffs <= threshold), k=1))
+    return [[int(a) + 1, int(b) + 1, int(diffs[a, b])] for a, b in pairs]
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    if not args.dump:
+        RunDmdImage.logger.setLevel(logging.INFO)
+
+    name_filter = None
+    if args.include or args.exclude:
+        name_filter = RunDmdImage.RunDmdNameFilter(args.include, args.exclude, args.regex)
+
+    rundmd = RunDmdImage.RunDmdImage()
+    report = []
+    with open(args.image.name, 'rb') as fh:
+        for offset, header_data, ani in rundmd.read_binary_headers(fh):
+            if name_filter != None and not name_filter(ani.header['name']):
+                continue
+            frame_data = rundmd.read_binary_frames(fh, ani)
+            issue = ani.analyze_binary_frames(frame_data)
+            issue['near_identical'] = near_identical(frame_data, ani.header['num_bitmaps'], args.threshold) if args.threshold > 0 else []
+            if not (issue['unreferenced'] or issue['identical'] or issue['near_identical'] or issue['missing']):
+                continue
+            issue['header_offset'] = offset
+            issue['frames_offset'] = ani.header['frames_addr']
+            report.append(issue)
+
+            print('{} ({} bitmaps)'.format(issue['name'], issue['num_bitmaps']))
+            if issue['unreferenced']:
+                print('  Unreferenced bitmaps: {}'.format(', '.join(str(b) for b in issue['unreferenced'])))
+            for group in issue['identical']:
+                print('  Identical bitmaps: {}'.format(', '.join(str(b) for b in group)))
+            for a, b, diff in issue['near_identical']:
+                print('  Near-identical bitmaps: {} and {} ({} pixels differ)'.format(a, b, diff))
+            for frame_num, bitmap_num in issue['missing']:
+                print('  Frame {} references missing bitmap {}'.format(frame_num, bitmap_num))
+            if args.dump:
+                rundmd.debug_dump_binary_animation(offset, header_data, frame_data)
+
+    print('{} of {} animations have bitmap issues'.format(len(report), rundmd.header.header['total_animations']))
+    if args.report:
+        with open(args.report.name, 'w') as fh:
+            fh.write(json.dumps({'version' : rundmd.header.header['version'], 'animations' : report}, indent=2))
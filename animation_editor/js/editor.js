@@ -6,6 +6,7 @@ const colors = ['#000000', '#700000', '#7b0000', '#860000', '#910000', '#9c0000'
 
 
 const fileInput = document.querySelector('#file-button');
+const serverAnimation = document.querySelector('#server-animation');
 const saveButton = document.querySelector('#save-button');
 const playButton = document.querySelector('#play-button');
 
@@ -34,24 +35,135 @@ var aniData;
 var cur_color;
 var frame_history = [];
 var frame_history_idx = -1;
+var server_animation_id = null;
+
+function showAnimation() {
+    frameNumber.setAttribute('min', '0');
+    frameNumber.setAttribute('max', (aniData['frames'].length - 1).toString());
+    frameNumber.value = 0;
+    getHeaderOptions();
+}
 
 function loadAnimationFile() {
     let file = fileInput.files[0];
     let fr = new FileReader();
     fr.onload = receivedText;
     fr.readAsText(file);
+    server_animation_id = null;
     
     function receivedText(e) {
         let lines = e.target.result;
         aniData = JSON.parse(lines);
-        frameNumber.setAttribute('min', '0');
-        frameNumber.setAttribute('max', (aniData['frames'].length - 1).toString());
-        frameNumber.value = 0;
-        getHeaderOptions();
+        showAnimation();
+    }
+}
+
+/* Preview server (preview_server.py) support */
+function decodeAnimationBinary(buf) {
+    // See build_binary_payload in preview_server.py for the layout
+    const view = new DataView(buf);
+    const hex = [];
+    for (let i = 0; i < 256; i++) {
+        hex.push((i < 16 ? '0' : '') + i.toString(16));
+    }
+    let offset = 0;
+    let header_len = view.getUint32(offset);
+    offset += 4;
+    let header = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, offset, header_len)));
+    offset += header_len;
+    let num_frames = view.getUint16(offset);
+    let num_bitmaps = view.getUint16(offset + 2);
+    offset += 4;
+    let table = [];
+    for (let i = 0; i < num_frames; i++) {
+        table.push([view.getUint8(offset), view.getUint16(offset + 1)]);
+        offset += 3;
     }
+    
+    let bitmaps = [];
+    let transparent_row = '|' + 'a'.repeat(128) + '|';
+    for (let b = 0; b < num_bitmaps; b++) {
+        let rows = [];
+        for (let y = 0; y < 32; y++) {
+            let row = '|';
+            for (let x = 0; x < 64; x++) {
+                row += hex[view.getUint8(offset++)];
+            }
+            rows.push(row + '|');
+        }
+        bitmaps.push(rows);
+    }
+    
+    let frames = [];
+    for (let i = 0; i < num_frames; i++) {
+        let bitmap_num = table[i][0];
+        let bitmap = bitmap_num == 0 ? new Array(32).fill(transparent_row) : bitmaps[bitmap_num - 1].slice();
+        frames.push({'frame_num' : i, 'duration' : table[i][1], 'bitmap' : bitmap});
+    }
+    return {'header' : header, 'frames' : frames};
+}
+
+function loadServerAnimation() {
+    let id = serverAnimation.value;
+    fetch('api/animations/' + id + '.bin')
+        .then(response => response.arrayBuffer())
+        .then(buf => {
+            aniData = decodeAnimationBinary(buf);
+            server_animation_id = id;
+            clearHistory();
+            showAnimation();
+        });
+}
+
+function loadServerAnimationList() {
+    fetch('api/animations')
+        .then(response => response.ok ? response.json() : [])
+        .then(animations => {
+            if (animations.length == 0) {
+                return;
+            }
+            let groups = {};
+            let placeholder = document.createElement('option');
+            placeholder.textContent = 'Select an animation';
+            placeholder.disabled = true;
+            placeholder.selected = true;
+            serverAnimation.appendChild(placeholder);
+            for (const ani of animations) {
+                if (!(ani['title'] in groups)) {
+                    groups[ani['title']] = document.createElement('optgroup');
+                    groups[ani['title']].label = ani['title'];
+                    serverAnimation.appendChild(groups[ani['title']]);
+                }
+                let option = document.createElement('option');
+                option.value = ani['id'];
+                option.textContent = ani['name'];
+                groups[ani['title']].appendChild(option);
+            }
+            serverAnimation.hidden = false;
+        })
+        .catch(() => {});
+}
+
+function saveServerAnimation() {
+    for (let i = 0; i < aniData['frames'].length; i++) {
+        aniData['frames'][i]['frame_num'] = i;
+    }
+    fetch('api/animations/' + server_animation_id, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify(aniData)
+    }).then(response => {
+        if (!response.ok) {
+            response.text().then(text => alert(text));
+        }
+    });
 }
 
 function saveAnimationFile() {
+    if (server_animation_id !== null) {
+        saveServerAnimation();
+        return;
+    }
     const a = document.createElement('a');
     var cur_file = fileInput.files[0].name;
     var cur_file_ext = cur_file.split('.').pop();
@@ -515,6 +627,7 @@ function dropFrameForwardFunc() {
 }
 
 fileInput.addEventListener('input', loadAnimationFile);
+serverAnimation.addEventListener('input', loadServerAnimation);
 saveButton.addEventListener('click', saveAnimationFile);
 playButton.addEventListener('click', playAnimation);
 
@@ -566,6 +679,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     makeGrid();
+    loadServerAnimationList();
     
     clockData = 
         {
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import argparse
+import json
+import RunDmdImage
+
+
+def parse_arguments():
+    def id_list(string):
+        try:
+            return [int(v) for v in string.split(',')]
+        except ValueError:
+            raise argparse.ArgumentTypeError('Expected comma separated global IDs: {}'.format(string))
+
+    parser = argparse.ArgumentParser(description='Enable or disable animations in place in a RunDMD binary image')
+    parser.add_argument('--image', help='RunDMD raw binary image path', type=argparse.FileType('r'), required=True)
+    parser.add_argument('--profiles', help='JSON file with named profiles', type=argparse.FileType('r'))
+    parser.add_argument('--profile', help='Name of the profile in --profiles to apply')
+    parser.add_argument('--enable', help='Enable animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--disable', help='Disable animations whose name or title group matches this pattern, even if enabled otherwise (can be repeated)', action='append')
+    parser.add_argument('--global-ids', help='Enable the animations with these comma separated global IDs', type=id_list)
+    parser.add_argument('--regex', help='Treat --enable/--disable patterns as regular expressions instead of globs', action='store_true', default=False)
+    parser.add_argument('--dry-run', help='Only print what would change', action='store_true', default=False)
+    args = parser.parse_args()
+    if args.profiles and not args.profile:
+        parser.error('--profiles needs --profile')
+    return args
+
+def build_enable_filter(enable, disable, global_ids, use_regex):
+    '''
+    Animations are enabled if they match an enable pattern or global ID (or if neither is given), and
+    do not match a disable pattern
+    '''
+    enable_names = RunDmdImage.RunDmdNameFilter(enable, None, use_regex) if enable else None
+    disable_names = RunDmdImage.RunDmdNameFilter(disable, None, use_regex) if disable else None
+    global_ids = set(global_ids or [])
+
+    def enable_filter(ani):
+        if disable_names != None and disable_names(ani.header['name']):
+            return False
+        if enable_names == None and len(global_ids) == 0:
+            return True
+        if enable_names != None and enable_names(ani.header['name']):
+            return True
+        return ani.header['global_id'] in global_ids
+    return enable_filter
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    enable, disable, global_ids, use_regex = args.enable, args.disable, args.global_ids, args.regex
+    if args.profile:
+        with open(args.profiles.name, 'r') as fh:
+            profiles = json.load(fh)['profiles']
+        if args.profile not in profiles:
+            print('Unknown profile {}, available: {}'.format(args.profile, ', '.join(sorted(profiles))))
+            sys.exit(1)
+        profile = profiles[args.profile]
+        enable = (enable or []) + profile.get('enable', [])
+        disable = (disable or []) + profile.get('disable', [])
+        global_ids = (global_ids or []) + profile.get('global_ids', [])
+        use_regex = use_regex or profile.get('regex', False)
+
+    rundmd = RunDmdImage.RunDmdImage()
+    changes = rundmd.apply_enable_profile(args.image.name, build_enable_filter(enable, disable, global_ids, use_regex), dry_run=args.dry_run)
+    for name, enabled in changes:
+        print('{} {}'.format('Enable ' if enabled else 'Disable', name))
+    print('{} animations changed, {} of {} enabled{}'.format(len(changes), rundmd.enable_count(rundmd.header.header['enabled_animations']),
+                                                            rundmd.header.header['total_animations'], ' (dry run)' if args.dry_run else ''))
@@ -3,6 +3,7 @@
 import sys
 import os
 import argparse
+import json
 import RunDmdImage
 
 
@@ -15,8 +16,13 @@ def parse_arguments():
 
     parser = argparse.ArgumentParser(description='Create a RunDMD binary image based on a directory with header and animation files')
     parser.add_argument('--input-dir', help='Path to read the extracted JSON files from', type=dir_path, required=True)
-    parser.add_argument('--image', help='RunDMD raw binary image name to be created', type=argparse.FileType('w'), required=True)
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('--image', help='RunDMD raw binary image name to be created', type=argparse.FileType('w'))
+    output.add_argument('--variants', help='JSON build matrix describing several images to create from the same input (see README)', type=argparse.FileType('r'))
     parser.add_argument('--pad-size', help='RunDMD image minimum size', type=int, default=0)
+    parser.add_argument('--workers', help='Number of writer threads (default is based on the CPU count)', type=int)
+    parser.add_argument('--fsync', help='When to flush the image to the device', choices=['none', 'end', 'each'], default='none')
+    parser.add_argument('--max-bitmaps', help='Merge near-identical bitmaps of animations with more than this many distinct bitmaps (see reduce_bitmaps.py)', type=int)
     return parser.parse_args()
 
 if __name__ == '__main__':
@@ -29,7 +35,7 @@ if __name__ == '__main__':
     os.chdir(input_dir)
     with open ('header.json', 'r') as fh:
         json_data = fh.read()
-    rundmd.load_json_header_data(json_data)
+    rundmd.load_json_header_data(json_data, input_dir)
 
     for d in sorted(os.listdir(input_dir)):
         path = os.path.join(input_dir, d)
@@ -49,6 +55,34 @@ if __name__ == '__main__':
             rundmd.load_json_animation_data(json_data, name=name)
             cnt += 1
     
-    rundmd.finalize()
-    image_path = os.path.join(base_dir, args.image.name)
-    rundmd.write_full_binary(image_path, args.pad_size)
+    if args.max_bitmaps != None:
+        for title in sorted(rundmd.animations):
+            for ani in rundmd.animations[title]:
+                report = ani.reduce_bitmaps(max_bitmaps=args.max_bitmaps)
+                if report['bytes_saved']:
+                    print('Reduced  {} from {} to {} bitmaps ({} bytes saved, max {} pixels changed per frame)'.format(
+                        ani.header['name'], report['bitmaps_before'], report['bitmaps_after'], report['bytes_saved'], report['max_error_pixels']))
+
+    if args.variants:
+        with open(os.path.join(base_dir, args.variants.name), 'r') as fh:
+            variants = json.load(fh)['variants']
+        print('Encoding animations')
+        rundmd.encode_frames(args.workers)
+        for variant in variants:
+            name_filter = None
+            if 'include' in variant or 'exclude' in variant:
+                name_filter = RunDmdImage.RunDmdNameFilter(variant.get('include'), variant.get('exclude'), variant.get('regex', False))
+            enable_filter = None
+            if variant.get('enable_all'):
+                enable_filter = lambda name: True
+            elif 'enable' in variant or 'disable' in variant:
+                enable_filter = RunDmdImage.RunDmdNameFilter(variant.get('enable'), variant.get('disable'), variant.get('regex', False))
+            animations = rundmd.select_variant(name_filter, variant.get('order'))
+            image_path = os.path.join(base_dir, variant['image'])
+            count, enabled, size = rundmd.write_variant(image_path, animations, enable_filter, variant.get('pad_size', args.pad_size),
+                                                        workers=args.workers, fsync=args.fsync)
+            print('Wrote {} ({} animations, {} enabled, {} bytes used)'.format(variant['image'], count, enabled, size))
+    else:
+        rundmd.finalize()
+        image_path = os.path.join(base_dir, args.image.name)
+        rundmd.write_full_binary(image_path, args.pad_size, workers=args.workers, fsync=args.fsync)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+import RunDmdImage
+import RunDmdBitmap
+
+
+def parse_arguments():
+    def dir_path(string):
+        if os.path.isdir(string) and os.access(string, os.R_OK):
+            return string
+        else:
+            raise argparse.ArgumentTypeError('Unable to read from: {}'.format(string))
+
+    def int_list(count):
+        def parse(string):
+            try:
+                vals = [int(v) for v in string.split(',')]
+            except ValueError:
+                vals = []
+            if len(vals) != count:
+                raise argparse.ArgumentTypeError('Expected {} comma separated integers: {}'.format(count, string))
+            return vals
+        return parse
+
+    def nibble_mapping(string):
+        try:
+            return {int(src, 16) : int(dst, 16) for src, dst in (pair.split(':') for pair in string.split(','))}
+        except ValueError:
+            raise argparse.ArgumentTypeError('Expected comma separated SRC:DST hex nibble pairs: {}'.format(string))
+
+    parser = argparse.ArgumentParser(description='Apply bitmap edits to every frame of one or more JSON animation files')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input-dir', help='Path to a directory of extracted JSON files (as written by rip_image.py)', type=dir_path)
+    source.add_argument('--input-json', help='Input JSON animation filename (can be repeated)', action='append')
+    parser.add_argument('--output-dir', help='Write the edited files here instead of editing them in place')
+    parser.add_argument('--include', help='Only edit animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--exclude', help='Skip animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--regex', help='Treat --include/--exclude patterns as regular expressions instead of globs', action='store_true', default=False)
+    parser.add_argument('--workers', help='Number of worker processes (default is one per CPU)', type=int)
+    # Operations, applied in the order listed here
+    parser.add_argument('--crop', help='Keep only X_START,X_END,Y_START,Y_END and make the rest transparent', type=int_list(4))
+    parser.add_argument('--translate', help='Shift by DX,DY pixels', type=int_list(2))
+    parser.add_argument('--wrap', help='Wrap pixels around the edges when translating', action='store_true', default=False)
+    parser.add_argument('--flip', help='Flip horizontally (h), vertically (v) or both (hv)', choices=['h', 'v', 'hv'])
+    parser.add_argument('--invert', help='Invert the intensity levels', action='store_true', default=False)
+    parser.add_argument('--remap', help='Replace nibbles, e.g. "1:0,2:0,f:e"', type=nibble_mapping)
+    parser.add_argument('--overlay-json', help='JSON animation whose first frame is drawn on top of every frame (transparency is respected)', type=argparse.FileType('r'))
+    parser.add_argument('--overlay-pos', help='X,Y position of the overlay', type=int_list(2), default=[0, 0])
+    return parser.parse_args()
+
+def build_operations(args):
+    ops = []
+    if args.crop:
+        ops.append(('mask', args.crop, {}))
+    if args.translate:
+        ops.append(('translate', args.translate, {'wrap' : args.wrap}))
+    if args.flip:
+        ops.append(('flip', [], {'horizontal' : 'h' in args.flip, 'vertical' : 'v' in args.flip}))
+    if args.invert:
+        ops.append(('remap', [RunDmdBitmap.invert_lut()], {}))
+    if args.remap:
+        ops.append(('remap', [RunDmdBitmap.mapping_lut(args.remap)], {}))
+    if args.overlay_json:
+        with open(args.overlay_json.name, 'r') as fh:
+            logo = RunDmdBitmap.rows_to_array(json.load(fh)['frames'][0]['bitmap'])
+        ops.append(('overlay', [logo] + args.overlay_pos, {}))
+    return ops
+
+def edit_animation(job):
+    in_path, out_path, ops = job
+    with open(in_path, 'r') as fh:
+        data = json.load(fh)
+    ani = RunDmdImage.RunDmdAnimation()
+    ani.frames = data['frames']
+    for op_name, op_args, op_kwargs in ops:
+        ani.apply_bitmap_op(getattr(RunDmdBitmap, op_name), *op_args, **op_kwargs)
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with open(out_path, 'w') as fh:
+        fh.write(json.dumps(data, indent=2))
+    return out_path
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    ops = build_operations(args)
+    if len(ops) == 0:
+        print('No edits requested')
+        sys.exit(1)
+
+    name_filter = None
+    if args.include or args.exclude:
+        name_filter = RunDmdImage.RunDmdNameFilter(args.include, args.exclude, args.regex)
+
+    jobs = []
+    if args.input_dir:
+        input_dir = os.path.abspath(args.input_dir)
+        for d in sorted(os.listdir(input_dir)):
+            path = os.path.join(input_dir, d)
+            if not os.path.isdir(path):
+                continue
+            for f in sorted(os.listdir(path)):
+                if os.path.splitext(f)[1] != '.json':
+                    continue
+                if name_filter != None and not name_filter(os.path.splitext(f)[0]):
+                    continue
+                out_path = os.path.join(args.output_dir, d, f) if args.output_dir else os.path.join(path, f)
+                jobs.append((os.path.join(path, f), out_path, ops))
+    else:
+        for in_path in args.input_json:
+            out_path = os.path.join(args.output_dir, os.path.basename(in_path)) if args.output_dir else in_path
+            jobs.append((in_path, out_path, ops))
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for out_path in executor.map(edit_animation, jobs, chunksize=4):
+            print('Wrote {}'.format(out_path))
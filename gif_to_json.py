@@ -5,7 +5,10 @@ import os
 import argparse
 import RunDmdImage
 import json
+import numpy as np
 from PIL import Image
+import RunDmdBitmap
+import RunDmdFrameCache
 
 def parse_arguments():
     def dir_path(string):
@@ -22,16 +25,42 @@ def parse_arguments():
     parser.add_argument('--x-end', help='Ending X coordinate', type=int)
     parser.add_argument('--y-start', help='Starting Y coordinate', type=int)
     parser.add_argument('--y-end', help='Ending Y coordinate', type=int)
+    parser.add_argument('--dither', help='Dithering used when reducing to the DMD intensity levels', choices=['none', 'bayer', 'floyd-steinberg'], default='none')
+    parser.add_argument('--cache-dir', help='Keep decoded frames in this directory so later runs with other crop settings skip decoding')
+    parser.add_argument('--cache-width', help='Width the frames are downscaled to before caching', type=int, default=256)
+    parser.add_argument('--cache-size', help='Maximum size of the frame cache in MB, least recently used sources are evicted first', type=int, default=2048)
+    parser.add_argument('--progress', help='Print the number of converted frames every few seconds', action='store_true', default=False)
     parser.add_argument('--output-json', help='Output JSON filename', type=argparse.FileType('w'), required=True)
     return parser.parse_args()
 
+def decode_gif(fname):
+    '''Yield (PIL image, duration in ms) for every frame'''
+    original = Image.open(fname)
+    for frame_index in range(original.n_frames):
+        original.seek(frame_index)
+        yield original, original.info['duration']
+
+# Frames are quantized and written in chunks so memory use does not grow with the length of the source
+chunk_size = 256
+
+def write_frames(stream, pixels, durations, dither):
+    if len(pixels) == 0:
+        return
+    pixels = np.stack(pixels)
+    stream.write_bitmaps(RunDmdBitmap.quantize(pixels[..., 0], pixels[..., 1], dither=dither), durations)
+
 if __name__ == '__main__':
     args = parse_arguments()
 
-    original = Image.open(args.input_gif.name)
-    #original.show()
+    if args.cache_dir:
+        frame_cache = RunDmdFrameCache.RunDmdFrameCache(args.cache_dir, args.cache_size * 1024 * 1024)
+        cached = frame_cache.load(args.input_gif.name, args.cache_width, lambda: decode_gif(args.input_gif.name), mode='LA')
+        width, height = cached['source_width'], cached['source_height']
+        frames = RunDmdFrameCache.RunDmdFrameCache.images(cached)
+    else:
+        width, height = Image.open(args.input_gif.name).size
+        frames = decode_gif(args.input_gif.name)
 
-    width, height = original.size
     left = 0
     right = width
     top = 0
@@ -44,53 +73,37 @@ if __name__ == '__main__':
         top = args.y_start
     if args.y_end:
         bottom = args.y_end
-
-    buckets = 15
-    map_vals = []
-    stride = 256 // buckets
-    for i, s in enumerate(range(0, 255, stride)):
-        if i >= 10:
-            map_vals.append((s, s + stride - 1, i + 1))
-        else:
-            map_vals.append((s, s + stride - 1, i))
-    s, e, i = map_vals[-1]
-    map_vals[-1] = (s, 255, i)
+    crop_box = (left, top, right, bottom)
+    if args.cache_dir:
+        crop_box = RunDmdFrameCache.RunDmdFrameCache.crop_box(cached, *crop_box)
 
     ani = RunDmdImage.RunDmdAnimation()
     ani.load_binary_animation_header(bytearray(ani.block_size))
-
-    for frame_index in range(original.n_frames):
-        original.seek(frame_index)
-        cropped = original.crop((left, top, right, bottom))
-        #cropped.show()
-
-        resized = cropped.resize((128, 32))
-        #resized.show()
-
-        greyscale = resized.convert('LA')
-        #greyscale.show()
-
-        img_str = ''
-        for y in range(32):
-            for x in range(128):
-                #print('{},{}: {}'.format(x, y, greyscale.getpixel((x,y))))
-                l, a = greyscale.getpixel((x,y))
-                if a == 0:
-                    img_str += 'a'
-                else:
-                    for s, e, i in map_vals:
-                        if l >= s and l <= e:
-                            img_str += '{:x}'.format(i)
-        frame_rows = ani._frame_to_rows(img_str)
-        frame_info = {'duration' : original.info['duration'], 'bitmap' : frame_rows}
-        ani.frames.append(frame_info)
-    
     ani.header['flags'] = 'Enable'
     ani.header['display_width'] = 128
     ani.header['display_height'] = 32
-    ani.header['num_bitmaps'] = len(ani.frames)
-    ani.header['total_frames'] = len(ani)
-    
-    with open(args.output_json.name, 'w') as fh:
-        fh.write(ani.build_json_data())
+    progress = RunDmdImage.RunDmdProgress('Frames converted', 2.0) if args.progress else None
+    with ani.open_json_stream(args.output_json.name, progress) as stream:
+        pixels = []
+        durations = []
+
+        for original, duration in frames:
+            #original.show()
+
+            cropped = original.crop(crop_box)
+            #cropped.show()
+
+            resized = cropped.resize((128, 32))
+            #resized.show()
+
+            greyscale = resized.convert('LA')
+            #greyscale.show()
+
+            pixels.append(np.asarray(greyscale))
+            durations.append(duration)
+            if len(pixels) == chunk_size:
+                write_frames(stream, pixels, durations, args.dither)
+                pixels = []
+                durations = []
 
+        write_frames(stream, pixels, durations, args.dither)
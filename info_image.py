@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import argparse
+import json
+import RunDmdImage
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Print the title groups, counts, enable flags and sizes of a RunDMD binary image without decoding any bitmaps')
+    parser.add_argument('--image', help='RunDMD raw binary image path', type=argparse.FileType('r'), required=True)
+    parser.add_argument('--animations', help='List every animation, not just the title groups', action='store_true', default=False)
+    parser.add_argument('--json', help='Print the inventory as JSON', action='store_true', default=False)
+    parser.add_argument('--include', help='Only list animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--exclude', help='Skip animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--regex', help='Treat --include/--exclude patterns as regular expressions instead of globs', action='store_true', default=False)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    name_filter = None
+    if args.include or args.exclude:
+        name_filter = RunDmdImage.RunDmdNameFilter(args.include, args.exclude, args.regex)
+
+    rundmd = RunDmdImage.RunDmdImage()
+    rundmd.load_full_binary(args.image.name, name_filter=name_filter, headers_only=True)
+    main_header = rundmd.header.header
+
+    titles = []
+    for title in sorted(rundmd.animations):
+        animations = []
+        for ani in rundmd.animations[title]:
+            animations.append({
+                'name' : ani.header['name'],
+                'global_id' : ani.header['global_id'],
+                'enabled' : 'Enable' in ani.header['flags'],
+                'num_bitmaps' : ani.header['num_bitmaps'],
+                'total_frames' : ani.header['total_frames'],
+                'size' : ani.block_size + ani.header['num_bitmaps'] * ani.bitmap_size
+            })
+        titles.append({
+            'title' : title,
+            'animations' : len(animations),
+            'enabled' : sum(1 for a in animations if a['enabled']),
+            'num_bitmaps' : sum(a['num_bitmaps'] for a in animations),
+            'size' : sum(a['size'] for a in animations),
+            'details' : animations
+        })
+
+    if args.json:
+        for title in titles:
+            if not args.animations:
+                title.pop('details')
+        print(json.dumps({'version' : main_header['version'], 'total_animations' : main_header['total_animations'],
+                          'enabled_animations' : main_header['enabled_animations'], 'titles' : titles}, indent=2))
+        sys.exit(0)
+
+    print('Version:            {}'.format(main_header['version']))
+    print('Total animations:   {}'.format(main_header['total_animations']))
+    print('Enabled animations: {} (header count, includes the +1)'.format(main_header['enabled_animations']))
+    print('')
+    print('{:<32} {:>6} {:>8} {:>8} {:>12}'.format('Title', 'Count', 'Enabled', 'Bitmaps', 'Size'))
+    for title in titles:
+        print('{:<32} {:>6} {:>8} {:>8} {:>12}'.format(title['title'], title['animations'], title['enabled'], title['num_bitmaps'], title['size']))
+        if args.animations:
+            for a in title['details']:
+                print('  {:<30} {:>6} {:>8} {:>8} {:>12}  ({} frames)'.format(a['name'], a['global_id'], 'yes' if a['enabled'] else 'no',
+                                                                            a['num_bitmaps'], a['size'], a['total_frames']))
+    print('{:<32} {:>6} {:>8} {:>8} {:>12}'.format('TOTAL', sum(t['animations'] for t in titles), sum(t['enabled'] for t in titles),
+                                                   sum(t['num_bitmaps'] for t in titles), sum(t['size'] for t in titles)))
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import argparse
+import RunDmdImage
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Build a RunDMD binary image from animations copied verbatim out of other images')
+    parser.add_argument('--take', help='IMAGE [PATTERN ...]: copy the animations of IMAGE whose name or title group matches one of the patterns, or all of them if no pattern is given (can be repeated, the output keeps this order)',
+                        nargs='+', action='append', metavar='ARG', required=True)
+    parser.add_argument('--exclude', help='Skip animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--regex', help='Treat the patterns as regular expressions instead of globs', action='store_true', default=False)
+    parser.add_argument('--header-from', help='Image to copy the main header (startup picture, version, ...) from, default is the first --take image')
+    parser.add_argument('--image', help='RunDMD raw binary image name to be created', required=True)
+    parser.add_argument('--pad-size', help='RunDMD image minimum size', type=int, default=0)
+    parser.add_argument('--workers', help='Number of copy threads (default is based on the CPU count)', type=int)
+    parser.add_argument('--fsync', help='When to flush the image to the device', choices=['none', 'end', 'each'], default='none')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    image_path = os.path.abspath(args.image)
+    parts = []
+    for take in args.take:
+        src_fname = os.path.abspath(take[0])
+        if src_fname == image_path:
+            print('{} cannot be both a source and the output'.format(take[0]))
+            sys.exit(1)
+        name_filter = None
+        if len(take) > 1 or args.exclude:
+            name_filter = RunDmdImage.RunDmdNameFilter(take[1:] or None, args.exclude, args.regex)
+        parts.append((src_fname, name_filter))
+
+    rundmd = RunDmdImage.RunDmdImage()
+    with open(args.header_from or args.take[0][0], 'rb') as fh:
+        rundmd.read_binary_headers(fh)
+    count, enabled, size = rundmd.merge_binary(image_path, parts, args.pad_size, workers=args.workers, fsync=args.fsync)
+    print('Wrote {} ({} animations, {} enabled, {} bytes used)'.format(args.image, count, enabled, size))
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+'''
+NOTES:
+Small local HTTP server for browsing an image (or a directory of extracted JSON files) in the animation editor.  The editor
+files are served from animation_editor/, so point a browser at http://localhost:8000/animation_editor.html
+
+API:
+    GET  /api/animations            list of {id, title, name, total_frames, num_bitmaps, enabled}
+    GET  /api/animations/<id>.json  the animation in the same JSON shape rip_image.py writes
+    GET  /api/animations/<id>.bin   the animation in a compact binary form (see build_binary_payload)
+    POST /api/animations/<id>       save the animation (JSON shape) back to the image or library
+'''
+
+import sys
+import os
+import argparse
+import json
+import threading
+from collections import OrderedDict
+from struct import pack
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import RunDmdImage
+
+logger = RunDmdImage.logger
+
+
+def parse_arguments():
+    def dir_path(string):
+        if os.path.isdir(string) and os.access(string, os.R_OK):
+            return string
+        else:
+            raise argparse.ArgumentTypeError('Unable to read from: {}'.format(string))
+
+    parser = argparse.ArgumentParser(description='Serve the animations of a RunDMD image or JSON library to the animation editor')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--image', help='RunDMD raw binary image path', type=argparse.FileType('r'))
+    source.add_argument('--input-dir', help='Path to a directory of extracted JSON files (as written by rip_image.py)', type=dir_path)
+    parser.add_argument('--host', help='Address to listen on', default='127.0.0.1')
+    parser.add_argument('--port', help='Port to listen on', type=int, default=8000)
+    parser.add_argument('--cache-size', help='Number of decoded animations to keep in memory', type=int, default=64)
+    return parser.parse_args()
+
+def build_binary_payload(header, frame_table, bitmap_data):
+    '''
+    Binary layout (big endian):
+        u32 header JSON length, header JSON (user format, utf-8)
+        u16 total frames, u16 number of bitmaps
+        per frame: u8 bitmap number (1-based, 0 is a fully transparent frame), u16 duration in ms
+        packed bitmaps, two pixels per byte with the high nibble first
+    '''
+    header_json = json.dumps(header).encode('utf-8')
+    payload = bytearray(pack('>I', len(header_json)))
+    payload += header_json
+    payload += pack('>HH', len(frame_table), len(bitmap_data) // RunDmdImage.RunDmdAnimation.bitmap_size)
+    for bitmap_num, duration in frame_table:
+        payload += pack('>BH', bitmap_num, duration)
+    payload += bitmap_data
+    return bytes(payload)
+
+
+class AnimationCache(object):
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, loader):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            generation = self.generations.get(key, 0)
+        entry = loader(key)
+        with self.lock:
+            # A save that landed while the loader ran makes this entry stale, hand it out once but do not keep it
+            if self.generations.get(key, 0) != generation:
+                return entry
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, key):
+        with self.lock:
+            self.generations[key] = self.generations.get(key, 0) + 1
+            self.entries.pop(key, None)
+
+
+class ImageSource(object):
+    def __init__(self, fname):
+        self.fname = fname
+        self.lock = threading.Lock()
+        self.rundmd = RunDmdImage.RunDmdImage()
+        with open(fname, 'rb') as fh:
+            self.headers = self.rundmd.read_binary_headers(fh)
+
+    def count(self):
+        return len(self.headers)
+
+    def list(self):
+        animations = []
+        for i, (offset, header_data, ani) in enumerate(self.headers):
+            animations.append({'id' : i, 'title' : RunDmdImage.RunDmdTitleName(ani.header['name']), 'name' : ani.header['name'],
+                               'total_frames' : ani.header['total_frames'], 'num_bitmaps' : ani.header['num_bitmaps'],
+                               'enabled' : 'Enable' in ani.header['flags']})
+        return animations
+
+    def load(self, i):
+        offset, header_data, ani = self.headers[i]
+        with self.lock:
+            with open(self.fname, 'rb') as fh:
+                frame_data = self.rundmd.read_binary_frames(fh, ani)
+        ani = RunDmdImage.RunDmdAnimation()
+        ani.load_binary_data(header_data, frame_data)
+        json_data = ani.encode_json_data().encode('utf-8')
+        frame_table = [(ani.frame_to_bitmap[j] + 1, frame['duration']) for j, frame in enumerate(ani.frames)]
+        binary_data = build_binary_payload(ani.encode_json_header(), frame_table, frame_data[ani.block_size:])
+        return {'json' : json_data, 'bin' : binary_data}
+
+    def save(self, i, json_data):
+        offset, header_data, old_ani = self.headers[i]
+        ani = RunDmdImage.RunDmdAnimation()
+        ani.load_json_data(json_data)
+        with self.lock:
+            header = self.rundmd.write_binary_animation(self.fname, offset, old_ani.header, ani)
+            old_ani.header = header
+            self.headers[i] = (offset, old_ani.build_binary_animation_header(), old_ani)
+        logger.info('Saved {} to {}'.format(header['name'], self.fname))
+
+
+class LibrarySource(object):
+    def __init__(self, input_dir):
+        self.lock = threading.Lock()
+        self.files = []
+        for d in sorted(os.listdir(input_dir)):
+            path = os.path.join(input_dir, d)
+            if not os.path.isdir(path):
+                continue
+            for f in sorted(os.listdir(path)):
+                if os.path.splitext(f)[1] == '.json':
+                    self.files.append((d, os.path.join(path, f)))
+
+    def count(self):
+        return len(self.files)
+
+    def list(self):
+        animations = []
+        for i, (title, path) in enumerate(self.files):
+            animations.append({'id' : i, 'title' : title, 'name' : os.path.splitext(os.path.basename(path))[0]})
+        return animations
+
+    def load(self, i):
+        title, path = self.files[i]
+        with open(path, 'rb') as fh:
+            json_data = fh.read()
+        data = json.loads(json_data)
+        ani = RunDmdImage.RunDmdAnimation()
+        ani.load_json_data(json_data)
+        frames_binary, frame_to_bitmap = ani.encode_binary_frames()
+        frame_table = [(frame_to_bitmap[j], frame['duration']) for j, frame in enumerate(ani.frames)]
+        binary_data = build_binary_payload(data['header'], frame_table, frames_binary[ani.block_size:])
+        return {'json' : json_data, 'bin' : binary_data}
+
+    def save(self, i, json_data):
+        title, path = self.files[i]
+        data = json.loads(json_data)
+        # Validate before overwriting anything
+        RunDmdImage.RunDmdAnimation().load_json_data(json_data)
+        with self.lock:
+            with open(path, 'w') as fh:
+                fh.write(json.dumps(data, indent=2))
+        logger.info('Saved {}'.format(path))
+
+
+class PreviewRequestHandler(SimpleHTTPRequestHandler):
+    source = None
+    cache = None
+    # Host headers the server answers to, None when listening on every interface
+    allowed_hosts = None
+
+    def _send(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _animation_id(self, path):
+        try:
+            i = int(path.split('/')[-1].split('.')[0])
+        except ValueError:
+            return None
+        if i < 0 or i >= self.source.count():
+            return None
+        return i
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/api/animations':
+            self._send(200, 'application/json', json.dumps(self.source.list()).encode('utf-8'))
+        elif path.startswith('/api/animations/'):
+            i = self._animation_id(path)
+            if i == None:
+                self._send(404, 'text/plain', b'Unknown animation')
+                return
+            entry = self.cache.get(i, self.source.load)
+            if path.endswith('.bin'):
+                self._send(200, 'application/octet-stream', entry['bin'])
+            else:
+                self._send(200, 'application/json', entry['json'])
+        else:
+            super().do_GET()
+
+    def _same_origin(self):
+        '''
+        Saves overwrite the user's files, so only take them from the editor served here: the Host must be this server
+        (against DNS rebinding) and a browser supplied Origin must match it (against other pages posting to it)
+        '''
+        host = self.headers.get('Host')
+        if host == None or (self.allowed_hosts != None and host not in self.allowed_hosts):
+            return False
+        origin = self.headers.get('Origin')
+        return origin == None or origin == 'http://{}'.format(host)
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        i = self._animation_id(path) if path.startswith('/api/animations/') else None
+        if i == None:
+            self._send(404, 'text/plain', b'Unknown animation')
+            return
+        if not self._same_origin():
+            self._send(403, 'text/plain', b'Saves are only accepted from the editor served by this server')
+            return
+        # Unlike text/plain, a cross-origin application/json request needs a preflight this server never answers
+        if self.headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+            self._send(415, 'text/plain', b'Expected application/json')
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self._send(411, 'text/plain', b'Missing or invalid Content-Length')
+            return
+        json_data = self.rfile.read(length)
+        try:
+            self.source.save(i, json_data)
+        except (ValueError, KeyError, IndexError, TypeError, OverflowError) as e:
+            self._send(400, 'text/plain', 'Unable to save: {}'.format(e).encode('utf-8'))
+            return
+        self.cache.invalidate(i)
+        self._send(200, 'application/json', b'{}')
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    if args.image:
+        print('Reading animation headers from {}'.format(args.image.name))
+        source = ImageSource(os.path.abspath(args.image.name))
+    else:
+        source = LibrarySource(os.path.abspath(args.input_dir))
+    print('Serving {} animations'.format(len(source.list())))
+
+    editor_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'animation_editor')
+    PreviewRequestHandler.source = source
+    PreviewRequestHandler.cache = AnimationCache(args.cache_size)
+    if args.host not in ('', '0.0.0.0', '::'):
+        PreviewRequestHandler.allowed_hosts = ['{}:{}'.format(host, args.port) for host in set([args.host, '127.0.0.1', 'localhost'])]
+    handler = lambda *a, **kw: PreviewRequestHandler(*a, directory=editor_dir, **kw)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print('Open http://{}:{}/animation_editor.html'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
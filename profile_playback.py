@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import argparse
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import RunDmdImage
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Estimate the card read rate and timing of RunDMD animations during playback from their frame tables')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--image', help='RunDMD raw binary image path (only the headers and frame tables are read)', type=argparse.FileType('r'))
+    source.add_argument('--input-dir', help='Path to a directory of extracted JSON files (as written by rip_image.py)')
+    source.add_argument('--input-json', help='Input JSON animation filename (can be repeated)', action='append')
+    parser.add_argument('--budget', help='Flag animations whose peak read rate is above this many KB/s', type=float)
+    parser.add_argument('--window', help='Sliding window for the peak read rate in ms', type=int, default=1000)
+    parser.add_argument('--sort', help='Order of the report', choices=['name', 'peak', 'average', 'runtime'], default='name')
+    parser.add_argument('--report', help='Write the full report to this JSON file', type=argparse.FileType('w'))
+    parser.add_argument('--workers', help='Number of worker processes for JSON input (default is one per CPU)', type=int)
+    parser.add_argument('--include', help='Only profile animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--exclude', help='Skip animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--regex', help='Treat --include/--exclude patterns as regular expressions instead of globs', action='store_true', default=False)
+    return parser.parse_args()
+
+def profile_json(job):
+    json_path, name, window_ms = job
+    with open(json_path, 'r') as fh:
+        json_data = fh.read()
+    ani = RunDmdImage.RunDmdAnimation()
+    ani.load_json_data(json_data)
+    ani.header['name'] = name
+    return ani.playback_profile(ani.playback_frame_table(), window_ms, [frame['duration'] for frame in ani.frames])
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    RunDmdImage.logger.setLevel(logging.WARNING)
+
+    name_filter = None
+    if args.include or args.exclude:
+        name_filter = RunDmdImage.RunDmdNameFilter(args.include, args.exclude, args.regex)
+
+    profiles = []
+    if args.image:
+        rundmd = RunDmdImage.RunDmdImage()
+        with open(args.image.name, 'rb') as fh:
+            for offset, header_data, ani in rundmd.read_binary_headers(fh):
+                if name_filter != None and not name_filter(ani.header['name']):
+                    continue
+                fh.seek(ani.header['frames_addr'])
+                frame_table = ani.binary_frame_table(fh.read(ani.header['total_frames'] * 2))
+                profiles.append(ani.playback_profile(frame_table, args.window))
+    else:
+        json_paths = []
+        if args.input_dir:
+            for d in sorted(os.listdir(args.input_dir)):
+                path = os.path.join(args.input_dir, d)
+                if not os.path.isdir(path):
+                    continue
+                for f in sorted(os.listdir(path)):
+                    if os.path.splitext(f)[1] == '.json':
+                        json_paths.append(os.path.join(path, f))
+        else:
+            json_paths = args.input_json
+        jobs = []
+        for json_path in json_paths:
+            name = os.path.splitext(os.path.basename(json_path))[0]
+            if name_filter != None and not name_filter(name):
+                continue
+            jobs.append((json_path, name, args.window))
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            profiles = list(executor.map(profile_json, jobs, chunksize=8))
+
+    budget = args.budget * 1024 if args.budget != None else None
+    for profile in profiles:
+        profile['over_budget'] = budget != None and profile['peak_bytes_per_s'] > budget
+    sort_keys = {'name' : lambda p: p['name'], 'peak' : lambda p: -p['peak_bytes_per_s'],
+                 'average' : lambda p: -p['average_bytes_per_s'], 'runtime' : lambda p: -p['runtime_ms']}
+    profiles.sort(key=sort_keys[args.sort])
+
+    has_source = len(profiles) > 0 and 'source_runtime_ms' in profiles[0]
+    print('{:<32} {:>6} {:>7} {:>9} {:>10} {:>10}{}'.format('Animation', 'Frames', 'Bitmaps', 'Runtime', 'Avg KB/s', 'Peak KB/s',
+                                                         ' {:>11} {:>12}'.format('Max err ms', 'Drift ms') if has_source else ''))
+    for p in profiles:
+        print('{:<32} {:>6} {:>7} {:>8.2f}s {:>10.1f} {:>10.1f}{}{}'.format(p['name'], p['frames'], p['bitmaps'], p['runtime_ms'] / 1000,
+                                                                        p['average_bytes_per_s'] / 1024, p['peak_bytes_per_s'] / 1024,
+                                                                        ' {:>11} {:>12}'.format(p['max_duration_error_ms'], p['runtime_error_ms']) if has_source else '',
+                                                                        '  OVER BUDGET' if p['over_budget'] else ''))
+    over = [p for p in profiles if p['over_budget']]
+    if budget != None:
+        print('{} of {} animations exceed {} KB/s over a {} ms window'.format(len(over), len(profiles), args.budget, args.window))
+
+    if args.report:
+        with open(args.report.name, 'w') as fh:
+            fh.write(json.dumps({'window_ms' : args.window, 'budget_bytes_per_s' : budget, 'animations' : profiles}, indent=2))
+    sys.exit(1 if len(over) else 0)
@@ -5,7 +5,9 @@ import os
 import argparse
 import RunDmdImage
 import json
+import numpy as np
 from struct import unpack
+import RunDmdBitmap
 
 def parse_arguments():
     def dir_path(string):
@@ -18,27 +20,26 @@ def parse_arguments():
     parser.add_argument('--input-raw', help='Input RAW filename', type=argparse.FileType('r'), required=True)
     parser.add_argument('--frame-start', help='Starting frame number', type=int, default=0)
     parser.add_argument('--frame-end', help='Ending frame number', type=int, default=1000000000)
-    parser.add_argument('--x-start', help='Starting X coordinate', type=int)
-    parser.add_argument('--x-end', help='Ending X coordinate', type=int)
-    parser.add_argument('--y-start', help='Starting Y coordinate', type=int)
-    parser.add_argument('--y-end', help='Ending Y coordinate', type=int)
+    parser.add_argument('--x-start', help='Starting X coordinate (pixels outside the region are made transparent)', type=int)
+    parser.add_argument('--x-end', help='Ending X coordinate (pixels outside the region are made transparent)', type=int)
+    parser.add_argument('--y-start', help='Starting Y coordinate (pixels outside the region are made transparent)', type=int)
+    parser.add_argument('--y-end', help='Ending Y coordinate (pixels outside the region are made transparent)', type=int)
+    parser.add_argument('--progress', help='Print the number of converted frames every few seconds', action='store_true', default=False)
     parser.add_argument('--output-json', help='Output JSON filename', type=argparse.FileType('w'), required=True)
     return parser.parse_args()
 
 if __name__ == '__main__':
     args = parse_arguments()
 
-    map_vals = {
-        0 : 0,
-        1 : 5,
-        2 : 9,
-        3 : 15
-    }
+    # Number of lit sub-frame bitplanes -> nibble
+    map_vals = np.array([0, 5, 9, 15], dtype=np.uint8)
 
     ani = RunDmdImage.RunDmdAnimation()
     ani.load_binary_animation_header(bytearray(ani.block_size))
+    ani.header['flags'] = 'Enable'
+    progress = RunDmdImage.RunDmdProgress('Frames converted', 2.0) if args.progress else None
 
-    with open(args.input_raw.name, 'rb') as fh:
+    with open(args.input_raw.name, 'rb') as fh, ani.open_json_stream(args.output_json.name, progress) as stream:
         header_vals = unpack('>3sHBBB', fh.read(8))
         if header_vals[0].decode('ascii') != 'RAW':
             print('Not a raw file!')
@@ -49,6 +50,11 @@ if __name__ == '__main__':
         bitmaps_per_frame = header_vals[4]
         frame_size_bytes = width * height // 8
         
+        # Everything outside of the requested region is made transparent
+        crop_region = None
+        if args.x_start != None or args.x_end != None or args.y_start != None or args.y_end != None:
+            crop_region = (args.x_start or 0, args.x_end or width, args.y_start or 0, args.y_end or height)
+        
         frame_num = 0
         last_time = None
         while True:
@@ -68,27 +74,15 @@ if __name__ == '__main__':
             frame_num += 1
             if frame_num < args.frame_start or frame_num > args.frame_end:
                 continue
-            img_str = ''
-            for i in range(width * height):
-                this_pixel = 0
-                for j in range(bitmaps_per_frame):
-                    this_pixel += (frames[j][i // 8] >> ((i % 8))) & 0x1
-                img_str += '{:x}'.format(map_vals[this_pixel])
-            frame_rows = ani._frame_to_rows(img_str)
-            print('--- Frame number {}:'.format(frame_num))
-            for row in frame_rows:
-                print('  {}'.format(row))
-            frame_info = {'duration' : frame_dur, 'bitmap' : frame_rows}
-            ani.frames.append(frame_info)
-    
-    print('Processed {} frames'.format(frame_num))
-    
-    ani.header['flags'] = 'Enable'
-    ani.header['display_width'] = width
-    ani.header['display_height'] = height
-    ani.header['num_bitmaps'] = len(ani.frames)
-    ani.header['total_frames'] = len(ani.frames)
+            planes = np.frombuffer(b''.join(frames), dtype=np.uint8).reshape(bitmaps_per_frame, frame_size_bytes)
+            lit = np.unpackbits(planes, axis=1, bitorder='little').sum(axis=0)
+            bitmap = map_vals[lit].reshape(height, width)
+            if crop_region != None:
+                bitmap = RunDmdBitmap.mask(bitmap, *crop_region)
+            stream.write_frame(frame_dur, RunDmdBitmap.array_to_rows(bitmap))
+        
+        ani.header['display_width'] = width
+        ani.header['display_height'] = height
     
-    with open(args.output_json.name, 'w') as fh:
-        fh.write(ani.build_json_data())
+    print('Processed {} frames, wrote {}'.format(frame_num, stream.frame_count))
 
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+import RunDmdImage
+
+
+def parse_arguments():
+    def dir_path(string):
+        if os.path.isdir(string) and os.access(string, os.R_OK):
+            return string
+        else:
+            raise argparse.ArgumentTypeError('Unable to read from: {}'.format(string))
+
+    parser = argparse.ArgumentParser(description='Merge near-identical bitmaps of JSON animation files to fit a bitmap budget or error threshold')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input-dir', help='Path to a directory of extracted JSON files (as written by rip_image.py)', type=dir_path)
+    source.add_argument('--input-json', help='Input JSON animation filename (can be repeated)', action='append')
+    parser.add_argument('--output-dir', help='Write the reduced files here instead of editing them in place')
+    parser.add_argument('--max-bitmaps', help='Keep at most this many distinct bitmaps per animation', type=int)
+    parser.add_argument('--max-error', help='Merge bitmaps that differ in at most this many pixels', type=int)
+    parser.add_argument('--dry-run', help='Only report what would be merged', action='store_true', default=False)
+    parser.add_argument('--include', help='Only reduce animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--exclude', help='Skip animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--regex', help='Treat --include/--exclude patterns as regular expressions instead of globs', action='store_true', default=False)
+    parser.add_argument('--workers', help='Number of worker processes (default is one per CPU)', type=int)
+    args = parser.parse_args()
+    if args.max_bitmaps == None and args.max_error == None:
+        parser.error('Give --max-bitmaps, --max-error or both')
+    return args
+
+def reduce_animation(job):
+    in_path, out_path, max_bitmaps, max_error, dry_run = job
+    with open(in_path, 'r') as fh:
+        data = json.load(fh)
+    ani = RunDmdImage.RunDmdAnimation()
+    ani.frames = data['frames']
+    report = ani.reduce_bitmaps(max_bitmaps, max_error)
+    report['path'] = out_path
+    if not dry_run and (report['bitmaps_after'] != report['bitmaps_before'] or out_path != in_path):
+        os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+        with open(out_path, 'w') as fh:
+            fh.write(json.dumps(data, indent=2))
+    return report
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    name_filter = None
+    if args.include or args.exclude:
+        name_filter = RunDmdImage.RunDmdNameFilter(args.include, args.exclude, args.regex)
+
+    jobs = []
+    if args.input_dir:
+        input_dir = os.path.abspath(args.input_dir)
+        for d in sorted(os.listdir(input_dir)):
+            path = os.path.join(input_dir, d)
+            if not os.path.isdir(path):
+                continue
+            for f in sorted(os.listdir(path)):
+                if os.path.splitext(f)[1] != '.json':
+                    continue
+                if name_filter != None and not name_filter(os.path.splitext(f)[0]):
+                    continue
+                out_path = os.path.join(args.output_dir, d, f) if args.output_dir else os.path.join(path, f)
+                jobs.append((os.path.join(path, f), out_path, args.max_bitmaps, args.max_error, args.dry_run))
+    else:
+        for in_path in args.input_json:
+            out_path = os.path.join(args.output_dir, os.path.basename(in_path)) if args.output_dir else in_path
+            jobs.append((in_path, out_path, args.max_bitmaps, args.max_error, args.dry_run))
+
+    bytes_saved = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for report in executor.map(reduce_animation, jobs, chunksize=4):
+            bytes_saved += report['bytes_saved']
+            if report['bitmaps_after'] == report['bitmaps_before']:
+                continue
+            print('{}: {} -> {} bitmaps, {} bytes saved, {} frames changed (max {} / mean {:.1f} pixels)'.format(
+                report['path'], report['bitmaps_before'], report['bitmaps_after'], report['bytes_saved'],
+                report['frames_changed'], report['max_error_pixels'], report['mean_error_pixels']))
+    print('{} bytes saved in {} animations{}'.format(bytes_saved, len(jobs), ' (dry run)' if args.dry_run else ''))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import argparse
+import json
+import html
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import RunDmdImage
+import RunDmdBitmap
+
+
+def parse_arguments():
+    def dir_path(string):
+        if os.path.isdir(string) and os.access(string, os.W_OK):
+            return string
+        try:
+            os.makedirs(string)
+            return string
+        except:
+            raise argparse.ArgumentTypeError('Unable to create or write to: {}'.format(string))
+
+    parser = argparse.ArgumentParser(description='Render RunDMD animations to animated GIF/APNG files or PNG contact sheets')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--image', help='RunDMD raw binary image path', type=argparse.FileType('r'))
+    source.add_argument('--input-dir', help='Path to a directory of extracted JSON files (as written by rip_image.py)')
+    source.add_argument('--input-json', help='Input JSON animation filename (can be repeated)', action='append')
+    parser.add_argument('--output-dir', help='Path to write the rendered files to', type=dir_path, required=True)
+    parser.add_argument('--format', help='Output format', choices=['gif', 'apng', 'sheet'], default='gif')
+    parser.add_argument('--scale', help='Pixel scale factor', type=int, default=4)
+    parser.add_argument('--columns', help='Number of frames per row in a contact sheet', type=int, default=8)
+    parser.add_argument('--workers', help='Number of render processes (default is one per CPU)', type=int)
+    parser.add_argument('--include', help='Only render animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--exclude', help='Skip animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--regex', help='Treat --include/--exclude patterns as regular expressions instead of globs', action='store_true', default=False)
+    return parser.parse_args()
+
+def palette_image(bitmap):
+    img = Image.fromarray(bitmap, 'P')
+    img.putpalette([c for rgb in RunDmdBitmap.palette_rgb for c in rgb])
+    img.info['transparency'] = RunDmdBitmap.transparent
+    return img
+
+def render_animation(job):
+    '''Render one animation.  Runs in a worker process, so everything it needs is in the job dict'''
+    if 'json_path' in job:
+        with open(job['json_path'], 'r') as fh:
+            frames = json.load(fh)['frames']
+    else:
+        frames = job['frames']
+    if len(frames) == 0:
+        return None
+
+    bitmaps = RunDmdBitmap.upscale(RunDmdBitmap.frames_to_array(frames), job['scale'])
+    durations = [max(frame['duration'], 10) for frame in frames]
+    out_dir = os.path.join(job['output_dir'], job['title'])
+    os.makedirs(out_dir, exist_ok=True)
+
+    if job['format'] == 'sheet':
+        out_file = '{}.png'.format(job['name'])
+        sheet = RunDmdBitmap.contact_sheet(bitmaps, columns=job['columns'], gap=job['scale'])
+        palette_image(sheet).save(os.path.join(out_dir, out_file), transparency=RunDmdBitmap.transparent)
+    elif job['format'] == 'gif':
+        out_file = '{}.gif'.format(job['name'])
+        images = [palette_image(bitmap) for bitmap in bitmaps]
+        images[0].save(os.path.join(out_dir, out_file), save_all=True, append_images=images[1:], duration=durations,
+                       loop=0, disposal=2, transparency=RunDmdBitmap.transparent)
+    else:
+        out_file = '{}.png'.format(job['name'])
+        images = [Image.fromarray(rgba, 'RGBA') for rgba in RunDmdBitmap.to_rgba(bitmaps)]
+        images[0].save(os.path.join(out_dir, out_file), save_all=True, append_images=images[1:], duration=durations,
+                       loop=0, disposal=1)
+    return (job['title'], job['name'], '{}/{}'.format(job['title'], out_file), len(frames), sum(durations))
+
+def write_index(output_dir, results):
+    titles = {}
+    for title, name, rel_path, num_frames, duration_ms in results:
+        titles.setdefault(title, []).append((name, rel_path, num_frames, duration_ms))
+    with open(os.path.join(output_dir, 'index.html'), 'w') as fh:
+        fh.write('<!DOCTYPE html>\n<html lang="en">\n<head><meta charset="utf-8"><title>RunDMD Animations</title>\n')
+        fh.write('<style>body{background:#202020;color:#e0e0e0;font-family:sans-serif}figure{display:inline-block;margin:8px}img{background:#404040;image-rendering:pixelated}</style>\n')
+        fh.write('</head>\n<body>\n')
+        for title in sorted(titles):
+            fh.write('<h2 id="{0}">{0}</h2>\n'.format(html.escape(title)))
+            for name, rel_path, num_frames, duration_ms in sorted(titles[title]):
+                fh.write('<figure><img src="{}" loading="lazy"><figcaption>{} ({} frames, {} ms)</figcaption></figure>\n'.format(
+                    html.escape(rel_path), html.escape(name), num_frames, duration_ms))
+        fh.write('</body>\n</html>\n')
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    output_dir = os.path.abspath(args.output_dir)
+    job_args = {'output_dir' : output_dir, 'format' : args.format, 'scale' : args.scale, 'columns' : args.columns}
+
+    name_filter = None
+    if args.include or args.exclude:
+        name_filter = RunDmdImage.RunDmdNameFilter(args.include, args.exclude, args.regex)
+
+    jobs = []
+    if args.image:
+        rundmd = RunDmdImage.RunDmdImage()
+        print('Loading and processing image')
+        rundmd.load_full_binary(args.image.name, name_filter=name_filter)
+        for title in sorted(rundmd.animations):
+            for ani in rundmd.animations[title]:
+                jobs.append(dict(job_args, title=title, name=ani.header['name'], frames=ani.frames))
+    else:
+        json_paths = []
+        if args.input_dir:
+            for d in sorted(os.listdir(args.input_dir)):
+                path = os.path.join(args.input_dir, d)
+                if not os.path.isdir(path):
+                    continue
+                for f in sorted(os.listdir(path)):
+                    if os.path.splitext(f)[1] == '.json':
+                        json_paths.append(os.path.join(path, f))
+        else:
+            json_paths = args.input_json
+        for json_path in json_paths:
+            name = os.path.splitext(os.path.basename(json_path))[0]
+            title = os.path.basename(os.path.dirname(os.path.abspath(json_path)))
+            if name_filter != None and not name_filter(name):
+                continue
+            jobs.append(dict(job_args, title=title, name=name, json_path=json_path))
+
+    print('Rendering {} animations'.format(len(jobs)))
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for result in executor.map(render_animation, jobs, chunksize=4):
+            if result == None:
+                continue
+            print('Wrote {}'.format(result[2]))
+            results.append(result)
+    write_index(output_dir, results)
+    print('Wrote index.html')
@@ -19,6 +19,10 @@ def parse_arguments():
     parser = argparse.ArgumentParser(description='Rip all headers and animations from a RunDMD binary image')
     parser.add_argument('--image', help='RunDMD raw binary image path', type=argparse.FileType('r'), required=True)
     parser.add_argument('--output-dir', help='Path to extract the RunDMD json files to', type=dir_path, required=True)
+    parser.add_argument('--include', help='Only rip animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--exclude', help='Skip animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--startup-format', help='Sidecar format for the startup picture (png needs Pillow)', choices=['bin', 'png'], default='bin')
+    parser.add_argument('--regex', help='Treat --include/--exclude patterns as regular expressions instead of globs', action='store_true', default=False)
     return parser.parse_args()
 
 if __name__ == '__main__':
@@ -26,27 +30,39 @@ if __name__ == '__main__':
 
     rundmd = RunDmdImage.RunDmdImage()
     print('Loading and processing image')
-    rundmd.load_full_binary(args.image.name)
-    main_header_json = rundmd.get_header()
+    name_filter = None
+    if args.include or args.exclude:
+        name_filter = RunDmdImage.RunDmdNameFilter(args.include, args.exclude, args.regex)
+    image_path = os.path.abspath(args.image.name)
     output_dir = os.path.abspath(args.output_dir)
     os.chdir(output_dir)
+
+    # Files are numbered by position within the title over the whole header table, so a filtered rip
+    # names every animation the same way a full rip does
+    ani_counts = {}
+    ani_files = []
+    with open(image_path, 'rb') as fh:
+        for offset, header_data, ani in rundmd.read_binary_headers(fh):
+            ani_name = RunDmdImage.RunDmdTitleName(ani.header['name'])
+            ani_counts[ani_name] = ani_counts.get(ani_name, -1) + 1
+            if name_filter == None or name_filter(ani.header['name']):
+                ani_files.append('{}_{:03d}.json'.format(ani_name, ani_counts[ani_name]))
+
+    # Animations are decoded, written and dropped one at a time so memory use does not grow with the image
+    for cur_file, (ani_name, ani) in zip(ani_files, rundmd.iter_full_binary(image_path, name_filter=name_filter)):
+        ani_path = os.path.join(output_dir, ani_name)
+        if not os.path.isdir(ani_path):
+            os.mkdir(ani_path)
+        print('Writing {}/{}'.format(ani_name, cur_file))
+        with open(os.path.join(ani_path, cur_file), 'w') as fh:
+            fh.write(ani.build_json_data())
+
+    # iter_full_binary loads the main header along the way
+    startup_file = 'startup_picture.{}'.format(args.startup_format)
+    main_header_json = rundmd.get_header(startup_file)
     print('Writing header.json')
     with open ('header.json', 'w') as fh:
         fh.write(main_header_json)
-
-    prev_ani_name = None
-    cur_ani_cnt = 0
-    for ani in rundmd.get_animations():
-        ani_name, ani_json = ani
-        if prev_ani_name != ani_name:
-            ani_path = os.path.join(output_dir, ani_name)
-            if not os.path.isdir(ani_path):
-                os.mkdir(ani_path)
-            os.chdir(ani_path)
-            prev_ani_name = ani_name
-            cur_ani_cnt = 0
-        cur_file = '{}_{:03d}.json'.format(ani_name, cur_ani_cnt)
-        print('Writing {}/{}'.format(ani_name, cur_file))
-        with open(cur_file, 'w') as fh:
-            fh.write(ani_json)
-        cur_ani_cnt += 1
+    print('Writing {}'.format(startup_file))
+    with open (startup_file, 'wb') as fh:
+        fh.write(rundmd.get_startup_picture(args.startup_format))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import argparse
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import RunDmdImage
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Check that every animation in a RunDMD binary image survives the binary -> JSON -> binary round trip')
+    parser.add_argument('--image', help='RunDMD raw binary image path', type=argparse.FileType('r'), required=True)
+    parser.add_argument('--report', help='Write the full report to this JSON file', type=argparse.FileType('w'))
+    parser.add_argument('--workers', help='Number of worker processes (default is one per CPU)', type=int)
+    parser.add_argument('--include', help='Only verify animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--exclude', help='Skip animations whose name or title group matches this pattern (can be repeated)', action='append')
+    parser.add_argument('--regex', help='Treat --include/--exclude patterns as regular expressions instead of globs', action='store_true', default=False)
+    parser.add_argument('--verbose', help='Keep the library debug logging', action='store_true', default=False)
+    return parser.parse_args()
+
+def verify_animation(job):
+    fname, header_offset, header_data = job
+    ani = RunDmdImage.RunDmdAnimation()
+    ani.load_binary_animation_header(header_data)
+    with open(fname, 'rb') as fh:
+        frame_data = RunDmdImage.RunDmdImage().read_binary_frames(fh, ani)
+    report = ani.verify_round_trip(header_data, frame_data)
+    # Turn the offsets into image offsets
+    report['header_offset'] = header_offset
+    report['frames_offset'] = ani.header['frames_addr']
+    for mismatch in report['header']:
+        mismatch['offset'] += header_offset
+    if report['frames'] != None and report['frames']['offset'] != None:
+        report['frames']['offset'] += ani.header['frames_addr']
+    return report
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    if not args.verbose:
+        RunDmdImage.logger.setLevel(logging.WARNING)
+    # Every animation is encoded exactly once, so the workers have no use for the shared encoder memo
+    RunDmdImage.RunDmdAnimation.encode_cache_max_bytes = 0
+
+    name_filter = None
+    if args.include or args.exclude:
+        name_filter = RunDmdImage.RunDmdNameFilter(args.include, args.exclude, args.regex)
+
+    fname = os.path.abspath(args.image.name)
+    rundmd = RunDmdImage.RunDmdImage()
+    with open(fname, 'rb') as fh:
+        headers = rundmd.read_binary_headers(fh)
+    jobs = [(fname, offset, header_data) for offset, header_data, ani in headers if name_filter == None or name_filter(ani.header['name'])]
+
+    reports = []
+    counts = {'exact' : 0, 'equivalent' : 0, 'different' : 0}
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for report in executor.map(verify_animation, jobs, chunksize=4):
+            reports.append(report)
+            counts[report['status']] += 1
+            if report['status'] == 'exact':
+                continue
+            print('{} ({}, header at 0x{:x}, frames at 0x{:x})'.format(report['name'], report['status'], report['header_offset'], report['frames_offset']))
+            for mismatch in report['header']:
+                print('  Header field {} at 0x{:x}: {} -> {}{}'.format(mismatch['field'], mismatch['offset'], mismatch['expected'], mismatch['actual'],
+                                                                     ' (bitmap storage)' if mismatch['storage'] else ''))
+            for mismatch in report['user_header']:
+                print('  User header field {}: {} -> {}'.format(mismatch['field'], mismatch['expected'], mismatch['actual']))
+            frames = report['frames']
+            if frames != None:
+                print('  Frame data: {} of {} bytes differ from 0x{:x} ({} -> {} bytes), {} frame table entries changed, bitmaps {}, durations {}'.format(
+                    frames['differing_bytes'], frames['expected_size'], frames['offset'], frames['expected_size'], frames['actual_size'],
+                    len(frames['table_entries']), 'equal' if frames['bitmaps_equal'] else 'DIFFER', 'equal' if frames['durations_equal'] else 'DIFFER'))
+
+    print('{} animations: {} exact, {} equivalent (same pixels, timing and user header, different bitmap storage), {} different'.format(
+        len(reports), counts['exact'], counts['equivalent'], counts['different']))
+    if args.report:
+        with open(args.report.name, 'w') as fh:
+            fh.write(json.dumps({'image' : os.path.basename(fname), 'version' : rundmd.header.header['version'], 'summary' : counts,
+                                 'animations' : reports}, indent=2))
+    sys.exit(1 if counts['different'] else 0)
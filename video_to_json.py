@@ -6,7 +6,10 @@ import argparse
 import RunDmdImage
 import json
 import imageio as iio
+import numpy as np
 from PIL import Image, ImageOps
+import RunDmdBitmap
+import RunDmdFrameCache
 
 def parse_arguments():
     def dir_path(string):
@@ -25,17 +28,54 @@ def parse_arguments():
     parser.add_argument('--y-end', help='Ending Y coordinate', type=int)
     parser.add_argument('--frame-skip', help='Number of frames to skip', type=int, default=0)
     parser.add_argument('--invert', help='Invert the colors', action='store_true', default=False)
+    parser.add_argument('--dither', help='Dithering used when reducing to the DMD intensity levels', choices=['none', 'bayer', 'floyd-steinberg'], default='none')
+    parser.add_argument('--cache-dir', help='Keep decoded frames in this directory so later runs with other crop/frame/invert settings skip decoding')
+    parser.add_argument('--cache-width', help='Width the frames are downscaled to before caching', type=int, default=256)
+    parser.add_argument('--cache-size', help='Maximum size of the frame cache in MB, least recently used sources are evicted first', type=int, default=2048)
+    parser.add_argument('--progress', help='Print the number of converted frames every few seconds', action='store_true', default=False)
     parser.add_argument('--output-json', help='Output JSON filename', type=argparse.FileType('w'), required=True)
     return parser.parse_args()
 
+def decode_video(fname, reader=None):
+    '''Yield (PIL image, duration in ms) for every frame, repeating the previous frame if one fails to decode'''
+    if reader == None:
+        reader = iio.get_reader(fname)
+    frame_time_ms = int(1000 / reader.get_meta_data()['fps'])
+    im = None
+    for i in range(len(reader)):
+        try:
+            im = reader.get_next_data()
+        except RuntimeError:
+            pass
+        if im is None:
+            continue
+        yield Image.fromarray(im), frame_time_ms
+
+# Frames are quantized and written in chunks so memory use does not grow with the length of the source
+chunk_size = 256
+
+def write_frames(stream, pixels, durations, dither):
+    if len(pixels) == 0:
+        return
+    pixels = np.stack(pixels)
+    stream.write_bitmaps(RunDmdBitmap.quantize(pixels[..., 0], pixels[..., 1], dither=dither), durations)
+
 if __name__ == '__main__':
     args = parse_arguments()
 
-    reader = iio.get_reader(args.input.name)
-    print('{}'.format(reader.get_meta_data()['size']))
+    if args.cache_dir:
+        frame_cache = RunDmdFrameCache.RunDmdFrameCache(args.cache_dir, args.cache_size * 1024 * 1024)
+        cached = frame_cache.load(args.input.name, args.cache_width, lambda: decode_video(args.input.name))
+        width, height = cached['source_width'], cached['source_height']
+        frame_time_ms = cached['durations'][0] if len(cached['durations']) > 0 else 0
+        frames = RunDmdFrameCache.RunDmdFrameCache.images(cached)
+    else:
+        reader = iio.get_reader(args.input.name)
+        width, height = reader.get_meta_data()['size']
+        frame_time_ms = int(1000 / reader.get_meta_data()['fps'])
+        frames = decode_video(args.input.name, reader)
+    print('{}'.format((width, height)))
 
-    width, height = reader.get_meta_data()['size']
-    frame_time_ms = int(1000 / reader.get_meta_data()['fps'])
     frame_time_ms *= (args.frame_skip + 1)
     left = 0
     right = width
@@ -49,72 +89,49 @@ if __name__ == '__main__':
         top = args.y_start
     if args.y_end:
         bottom = args.y_end
-
-    buckets = 15
-    map_vals = []
-    stride = 256 // buckets
-    for i, s in enumerate(range(0, 255, stride)):
-        if i >= 10:
-            map_vals.append((s, s + stride - 1, i + 1))
-        else:
-            map_vals.append((s, s + stride - 1, i))
-    s, e, i = map_vals[-1]
-    map_vals[-1] = (s, 255, i)
+    crop_box = (left, top, right, bottom)
+    if args.cache_dir:
+        crop_box = RunDmdFrameCache.RunDmdFrameCache.crop_box(cached, *crop_box)
 
     ani = RunDmdImage.RunDmdAnimation()
     ani.load_binary_animation_header(bytearray(ani.block_size))
-
-    #for i, im in enumerate(reader):
-    for i in range(len(reader)):
-        try:
-            im = reader.get_next_data()
-        except RuntimeError:
-            pass
-        if i % (args.frame_skip + 1) != 0:
-            continue
-        if args.frame_start and i < args.frame_start:
-            continue
-        if args.frame_end and i > args.frame_end:
-            break
-
-        original = Image.fromarray(im)
-        #original.show()
-
-        cropped = original.crop((left, top, right, bottom))
-        #cropped.show()
-
-        if args.invert == True:
-            inverted = ImageOps.invert(cropped)
-            cropped = inverted
-            #inverted.show()
-
-        resized = cropped.resize((128, 32))
-        #resized.show()
-
-        greyscale = resized.convert('LA')
-        #greyscale.show()
-
-        img_str = ''
-        for y in range(32):
-            for x in range(128):
-                #print('{},{}: {}'.format(x, y, greyscale.getpixel((x,y))))
-                l, a = greyscale.getpixel((x,y))
-                if a == 0:
-                    img_str += 'a'
-                else:
-                    for s, e, i in map_vals:
-                        if l >= s and l <= e:
-                            img_str += '{:x}'.format(i)
-        frame_rows = ani._frame_to_rows(img_str)
-        frame_info = {'duration' : frame_time_ms, 'bitmap' : frame_rows}
-        ani.frames.append(frame_info)
-    
     ani.header['flags'] = 'Enable'
     ani.header['display_width'] = 128
     ani.header['display_height'] = 32
-    ani.header['num_bitmaps'] = len(ani.frames)
-    ani.header['total_frames'] = len(ani.frames)
-    
-    with open(args.output_json.name, 'w') as fh:
-        fh.write(ani.build_json_data())
-
+    progress = RunDmdImage.RunDmdProgress('Frames converted', 2.0) if args.progress else None
+    with ani.open_json_stream(args.output_json.name, progress) as stream:
+        pixels = []
+        durations = []
+
+        for i, (original, duration) in enumerate(frames):
+            if i % (args.frame_skip + 1) != 0:
+                continue
+            if args.frame_start and i < args.frame_start:
+                continue
+            if args.frame_end and i > args.frame_end:
+                break
+
+            #original.show()
+
+            cropped = original.crop(crop_box)
+            #cropped.show()
+
+            if args.invert == True:
+                inverted = ImageOps.invert(cropped)
+                cropped = inverted
+                #inverted.show()
+
+            resized = cropped.resize((128, 32))
+            #resized.show()
+
+            greyscale = resized.convert('LA')
+            #greyscale.show()
+
+            pixels.append(np.asarray(greyscale))
+            durations.append(frame_time_ms)
+            if len(pixels) == chunk_size:
+                write_frames(stream, pixels, durations, args.dither)
+                pixels = []
+                durations = []
+
+        write_frames(stream, pixels, durations, args.dither)